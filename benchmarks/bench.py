@@ -0,0 +1,229 @@
+import argparse
+import binascii
+import json
+import os
+import struct
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bluepy.btle import ScanEntry  # noqa: E402
+
+from smartgadget.capture import replay_gadget  # noqa: E402
+from smartgadget.device import SmartGadget  # noqa: E402
+from smartgadget.scanner import SmartGadgetScanner  # noqa: E402
+from smartgadget.simulator import SimulatedPeripheral, TEMPERATURE  # noqa: E402
+
+
+def simulated_gadget(**config):
+    gadget = SmartGadget('e2:07:bc:53:40:61')
+    gadget.peripheral_factory = SimulatedPeripheral.factory(**config)
+    gadget.connect()
+    return gadget
+
+
+def prepare_download(args, columnar):
+    gadget = simulated_gadget(n_samples=args.samples, loss_rate=args.loss_rate)
+    gadget.subscribe_temperature()
+    gadget.subscribe_relative_humidity()
+    gadget.Logging.start_download(columnar, retries=0)
+    # the packets the simulated gadget would send, fed directly into the decoder
+    packets = list(gadget.peripheral._packets)
+    gadget.peripheral._packets.clear()
+    return gadget, packets
+
+
+def bench_download_decode(args, columnar):
+    def setup():
+        gadget, packets = prepare_download(args, columnar)
+        return gadget.Logging, packets
+
+    def run(logger, packets):
+        handle = logger.handleNotification
+        for h, data in packets:
+            handle(h, data)
+
+    return setup, run, 2 * args.samples
+
+
+def bench_notification_dispatch(args):
+    n = 100000
+
+    def setup():
+        gadget = simulated_gadget(n_samples=1)
+        gadget.subscribe_temperature()
+        for _ in range(2):
+            gadget.Temperature.register_listener(lambda value, characteristic: None)
+        return gadget, struct.pack('<f', 21.5)
+
+    def run(gadget, payload):
+        handle = gadget.handleNotification
+        for _ in range(n):
+            handle(TEMPERATURE, payload)
+
+    return setup, run, n
+
+
+def bench_unpack_data(args):
+    n = 200000
+
+    def setup():
+        gadget = simulated_gadget(n_samples=1)
+        return gadget.Temperature, struct.pack('<f', 21.5)
+
+    def run(characteristic, payload):
+        unpack = characteristic.unpack_data
+        for _ in range(n):
+            unpack(payload)
+
+    return setup, run, n
+
+
+def bench_scan_discovery(args):
+    n = 2000
+
+    def setup():
+        scanner = SmartGadgetScanner()
+        entries = []
+        for i in range(n):
+            entry = ScanEntry("e2:07:bc:53:{:02x}:{:02x}".format(i // 256, i % 256), 0)
+            name = b'\x11\tSmart Humigadget' if i % 2 == 0 else b'\x08\tBeacon1'
+            entry._update({'type': [2], 'rssi': [70], 'flag': [0],
+                           'd': [b'\x02\x01\x06' + name],
+                           'addr': [binascii.unhexlify(entry.addr.replace(':', ''))]})
+            entries.append(entry)
+        return scanner, entries
+
+    def run(scanner, entries):
+        handle = scanner.handleDiscovery
+        for entry in entries:
+            handle(entry, True, True)
+
+    return setup, run, n
+
+
+def bench_download(args):
+
+    def setup():
+        gadget = simulated_gadget(n_samples=args.samples, loss_rate=args.loss_rate,
+                                  packet_rate=args.packet_rate, live_interval=0.05, live_during_download=True)
+        gadget.Logging.DOWNLOAD_TIMEOUT = 0.5
+        return (gadget,)
+
+    def run(gadget):
+        gadget.download_temperature_and_relative_humidity(timeout=600, retries=10000)
+        if gadget.Logging.downloading or any(len(m) for m in gadget.Logging.missed_sequences.values()):
+            raise RuntimeError("simulated download incomplete")
+
+    return setup, run, 2 * args.samples
+
+
+def bench_replay(args):
+    # a captured field download replayed as fast as possible through the decoder
+
+    def setup():
+        gadget = replay_gadget(args.capture)
+        return (gadget,)
+
+    def run(gadget):
+        gadget.download_temperature_and_relative_humidity(timeout=600)
+
+    return setup, run, replay_gadget(args.capture).peripheral.remaining
+
+
+BENCHMARKS = [
+    ('download_decode_list', lambda args: bench_download_decode(args, False)),
+    ('download_decode_columnar', lambda args: bench_download_decode(args, True)),
+    ('notification_dispatch', bench_notification_dispatch),
+    ('unpack_data', bench_unpack_data),
+    ('scan_discovery', bench_scan_discovery),
+    ('download', bench_download),
+    ('replay', bench_replay),
+]
+
+
+def measure(setup, run, n_items, repeat):
+    times = []
+    for _ in range(repeat):
+        state = setup()
+        t0 = time.perf_counter()
+        run(*state)
+        times.append(time.perf_counter() - t0)
+
+    state = setup()
+    tracemalloc.start()
+    run(*state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = min(times)
+    return {'throughput': n_items / best,
+            'latency_us': best / n_items * 1e6,
+            'peak_kib': peak / 1024.}
+
+
+def calibrate(repeat):
+    # items/s of a fixed pure python loop, the results are compared relative to it,
+    # the absolute numbers differ between machines and between runs on a shared runner
+    packer = struct.Struct('<If')
+    n_items = 200000
+
+    def run():
+        values = []
+        for i in range(n_items):
+            values.append(packer.unpack(packer.pack(i, 1.5))[1])
+        return values
+
+    return measure(lambda: (), run, n_items, repeat)['throughput']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the smartgadget hot paths against a simulated gadget")
+    parser.add_argument('--samples', type=int, default=20000, help="samples in the simulated logger")
+    parser.add_argument('--loss-rate', type=float, default=0., help="fraction of lost download packets")
+    parser.add_argument('--packet-rate', type=float, default=None, help="packets per second, default unlimited")
+    parser.add_argument('--capture', help="capture file to replay, see smartgadget.capture")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='*', help="run only these benchmarks")
+    parser.add_argument('--save', help="write the results as baseline json")
+    parser.add_argument('--compare', help="compare against a baseline json, exit 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.3, help="allowed relative throughput loss")
+    args = parser.parse_args(argv)
+
+    calibration = calibrate(args.repeat)
+    results = {}
+    print("{:<26} {:>14,.0f}".format("calibration", calibration))
+    print("{:<26} {:>14} {:>12} {:>12}".format("benchmark", "items/s", "latency us", "peak KiB"))
+    for name, bench in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        if name == 'replay' and not args.capture:
+            continue
+        setup, run, n_items = bench(args)
+        results[name] = r = measure(setup, run, n_items, args.repeat)
+        print("{:<26} {:>14,.0f} {:>12.2f} {:>12.1f}".format(name, r['throughput'], r['latency_us'], r['peak_kib']))
+
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump(dict(results, calibration={'throughput': calibration}), fp, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        # the baseline scaled to the speed of this machine
+        scale = calibration / baseline['calibration']['throughput'] if 'calibration' in baseline else 1.
+        expected = dict((name, baseline[name]['throughput'] * scale) for name in results if name in baseline)
+        regressions = [name for name, throughput in expected.items()
+                       if results[name]['throughput'] < throughput * (1. - args.tolerance)]
+        for name in regressions:
+            print("REGRESSION {}: {:,.0f} items/s, baseline {:,.0f} items/s on this machine".format(
+                name, results[name]['throughput'], expected[name]))
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -49,7 +49,7 @@ setup(
         'Intended Audience :: Developers',
         'Programming Language :: Python :: 3',
     ],
-    entry_points={'console_scripts': []},
+    entry_points={'console_scripts': ['smartgadget=smartgadget.cli:main']},
     keywords='',
     packages=find_packages(exclude=['docs', 'tests*']),
     include_package_data=True,
@@ -1,6 +1,33 @@
-try:
-    import pkg_resources
+import sys
 
-    __version__ = pkg_resources.get_distribution('smartgadget').version
-except (pkg_resources.DistributionNotFound, ImportError):
-    __version__ = 'dev'
+
+def _get_version():
+    # importlib.metadata is much cheaper to import than pkg_resources, which is only a fallback
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return 'dev'
+        try:
+            return pkg_resources.get_distribution('smartgadget').version
+        except pkg_resources.DistributionNotFound:
+            return 'dev'
+    try:
+        return version('smartgadget')
+    except PackageNotFoundError:
+        return 'dev'
+
+
+if sys.version_info < (3, 7):
+    __version__ = _get_version()
+
+
+def __getattr__(name):
+    # resolve the version on first access only, it is not needed to talk to a gadget
+    if name == '__version__':
+        global __version__
+        __version__ = _get_version()
+        return __version__
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
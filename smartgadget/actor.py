@@ -0,0 +1,129 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+log = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class GadgetActor(object):
+    # owns the connection of a gadget, every call runs on its thread and returns a future
+    # bluepy peripherals are not thread-safe, the actor interleaves the calls of many threads
+    # with the notification pump on a single link
+
+    def __init__(self, gadget, wait_slice=0.1, maxsize=0):
+        self.gadget = gadget
+        self.addr = gadget.addr
+        # the longest a call waits for a running notification wait
+        self.wait_slice = wait_slice
+        self._commands = queue.Queue(maxsize)
+        self._pumping = False
+        self._closed = False
+        # nothing is queued after the stop command, the actor thread would never see it
+        self._close_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="smartgadget-{}".format(self.addr))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        if threading.current_thread() is self._thread:
+            # e.g. a listener calling back into the gadget, waiting for the queue would deadlock
+            self._execute(future, func, args, kwargs)
+            return future
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError("actor of '{}' is closed".format(self.addr))
+            self._commands.put((future, func, args, kwargs))
+        return future
+
+    def _execute(self, future, func, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def _pump(self):
+        try:
+            self.gadget.peripheral.waitForNotifications(self.wait_slice)
+        except Exception as e:
+            log.warning("notifications of '{}' stopped ({})".format(self.addr, e))
+            self._pumping = False
+            self.on_pump_error(e)
+
+    def _run(self):
+        while True:
+            pumping = self._pumping and self.gadget.connected
+            try:
+                command = self._commands.get_nowait() if pumping else self._commands.get()
+            except queue.Empty:
+                self._pump()
+                continue
+            if command is _STOP:
+                break
+            self._execute(*command)
+
+    def _set_pumping(self, pumping):
+        self._pumping = pumping
+
+    def start_notifications(self):
+        # wait for notifications whenever no call is queued, the listeners run on the actor thread
+        return self.submit(self._set_pumping, True)
+
+    def stop_notifications(self):
+        return self.submit(self._set_pumping, False)
+
+    def close(self, timeout=None):
+        # runs the calls queued so far, disconnecting is left to the caller, e.g. actor.disconnect() before
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._commands.put(_STOP)
+        self._thread.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def on_pump_error(self, error):
+        pass
+
+    def connect(self):
+        return self.submit(self.gadget.connect)
+
+    def disconnect(self):
+        return self.submit(self.gadget.disconnect)
+
+    def read_temperature(self):
+        return self.submit(self.gadget.read_temperature)
+
+    def read_relative_humidity(self):
+        return self.submit(self.gadget.read_relative_humidity)
+
+    def read_battery_level(self):
+        return self.submit(self.gadget.read_battery_level)
+
+    def read_all(self, max_age=None):
+        return self.submit(self.gadget.read_all, max_age)
+
+    def subscribe_temperature(self):
+        return self.submit(self.gadget.subscribe_temperature)
+
+    def subscribe_relative_humidity(self):
+        return self.submit(self.gadget.subscribe_relative_humidity)
+
+    def subscribe_battery_level(self):
+        return self.submit(self.gadget.subscribe_battery_level)
+
+    def download_temperature_and_relative_humidity(self, *args, **kwargs):
+        # pumps the notifications of the download itself, other calls wait until it finished
+        return self.submit(self.gadget.download_temperature_and_relative_humidity, *args, **kwargs)
@@ -0,0 +1,220 @@
+import logging
+import multiprocessing
+import os
+import pickle
+import re
+import threading
+from multiprocessing.connection import wait
+
+from .fleet import _FLEET_TIMEOUT, _downloading
+
+log = logging.getLogger(__name__)
+
+SYSFS_BLUETOOTH = '/sys/class/bluetooth'
+
+RESULT = 'result'
+ERROR = 'error'
+SIGHTINGS = 'sightings'
+DONE = 'done'
+
+
+def discover_adapters(path=SYSFS_BLUETOOTH):
+    # indices of the local controllers, e.g. [0, 1] for hci0 and hci1
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return [0]
+    adapters = sorted(int(m.group(1)) for m in (re.match(r'^hci(\d+)$', name) for name in names) if m)
+    return adapters or [0]
+
+
+def assign_adapters(sightings, adapters, rssi_margin=6.):
+    # sightings {addr: {iface: rssi}}, returns {iface: [addr]}
+    # every gadget goes to the least loaded adapter that receives it within rssi_margin dB of the best one
+    assignment = dict((iface, []) for iface in adapters)
+
+    def best_rssi(item):
+        rssi = [r for iface, r in item[1].items() if iface in assignment]
+        return max(rssi) if rssi else float('-inf')
+
+    # gadgets seen by fewer adapters have less choice, place them first
+    for addr, rssi in sorted(sightings.items(), key=lambda item: (len(item[1]), -best_rssi(item))):
+        rssi = dict((iface, r) for iface, r in rssi.items() if iface in assignment)
+        if rssi:
+            best = max(rssi.values())
+            candidates = [iface for iface, r in rssi.items() if r >= best - rssi_margin]
+        else:
+            candidates = list(assignment)
+        iface = min(candidates, key=lambda i: (len(assignment[i]), -rssi.get(i, float('-inf'))))
+        assignment[iface].append(addr)
+    return assignment
+
+
+class _Channel(object):
+    # the worker side of the pipe, shared by the fleet threads of the worker
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = threading.Lock()
+
+    def send(self, *message):
+        try:
+            data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            kind, addr, value = message
+            data = pickle.dumps((ERROR, addr, RuntimeError("{} ({} is not picklable)".format(value, e))),
+                                pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self.conn.send_bytes(data)
+
+
+def _scan_worker(iface, timeout, conn):
+    from .scanner import SmartGadgetScanner
+
+    channel = _Channel(conn)
+    try:
+        gadgets = SmartGadgetScanner(iface=iface).scan(timeout)
+        channel.send(SIGHTINGS, iface, dict((addr, getattr(gadget, 'rssi', None))
+                                            for addr, gadget in gadgets.items()))
+    except Exception as e:
+        log.warning("scan on hci{} failed: {}".format(iface, e))
+        channel.send(ERROR, iface, e)
+    finally:
+        channel.send(DONE, iface, None)
+        conn.close()
+
+
+def _job_worker(iface, addresses, job, max_connections, timeout, stand_down, conn):
+    from .device import SmartGadget
+    from .fleet import SmartGadgetFleet
+
+    channel = _Channel(conn)
+
+    def run(gadget):
+        # send every result as soon as it is there instead of after the whole fleet
+        channel.send(RESULT, gadget.addr, job(gadget))
+
+    try:
+        gadgets = []
+        for addr in addresses:
+            gadget = SmartGadget(addr)
+            gadget.iface = iface
+            gadgets.append(gadget)
+        fleet = SmartGadgetFleet(gadgets, max_workers=max_connections, max_per_adapter=max_connections,
+                                 timeout=timeout)
+        results, errors = fleet.run(run, stand_down=stand_down)
+        for addr, e in errors.items():
+            channel.send(ERROR, addr, e)
+    finally:
+        channel.send(DONE, iface, None)
+        conn.close()
+
+
+class AdapterCoordinator(object):
+
+    def __init__(self, adapters=None, max_per_adapter=4, timeout=120, rssi_margin=6.):
+        self.adapters = discover_adapters() if adapters is None else list(adapters)
+        self.max_per_adapter = max_per_adapter
+        self.timeout = timeout
+        self.rssi_margin = rssi_margin
+        # fork, the jobs are closures and do not need to be picklable
+        self._context = multiprocessing.get_context('fork')
+
+    def _spawn(self, target, args_by_iface):
+        pipes = {}
+        processes = []
+        for iface, args in args_by_iface.items():
+            reader, writer = self._context.Pipe(duplex=False)
+            process = self._context.Process(target=target, args=(iface,) + args + (writer,),
+                                            name="smartgadget-hci{}".format(iface))
+            process.daemon = True
+            process.start()
+            writer.close()
+            pipes[reader] = iface
+            processes.append(process)
+        return pipes, processes
+
+    def _messages(self, pipes, processes):
+        # merge the messages of all workers as they arrive
+        try:
+            while pipes:
+                for reader in wait(list(pipes)):
+                    try:
+                        message = pickle.loads(reader.recv_bytes())
+                    except EOFError:
+                        del pipes[reader]
+                        continue
+                    if message[0] == DONE:
+                        del pipes[reader]
+                        reader.close()
+                        continue
+                    yield message
+        finally:
+            for process in processes:
+                process.join(1.)
+                if process.is_alive():
+                    process.terminate()
+
+    def scan(self, timeout=10):
+        # scan on all adapters at the same time, returns {addr: {iface: rssi}}
+        sightings = {}
+        pipes, processes = self._spawn(_scan_worker, dict((iface, (timeout,)) for iface in self.adapters))
+        for kind, iface, value in self._messages(pipes, processes):
+            if kind == SIGHTINGS:
+                for addr, rssi in value.items():
+                    sightings.setdefault(addr, {})[iface] = rssi
+        log.info("found {} gadgets on {} adapters".format(len(sightings), len(self.adapters)))
+        return sightings
+
+    def assign(self, sightings):
+        return assign_adapters(sightings, self.adapters, self.rssi_margin)
+
+    def run(self, job, addresses=None, scan_timeout=10, timeout=_FLEET_TIMEOUT, stand_down=None):
+        # run job(gadget) on every gadget, one worker process per adapter, returns (results, errors)
+        # timeout per job, the timeout of the coordinator by default, None for none, see SmartGadgetFleet.run
+        if timeout is _FLEET_TIMEOUT:
+            timeout = self.timeout
+        if addresses is None:
+            sightings = self.scan(scan_timeout)
+        else:
+            sightings = dict((addr, {}) for addr in addresses)
+        assignment = dict((iface, addrs) for iface, addrs in self.assign(sightings).items() if addrs)
+        for iface, addrs in sorted(assignment.items()):
+            log.info("hci{}: {} gadgets".format(iface, len(addrs)))
+
+        results = {}
+        errors = {}
+        pipes, processes = self._spawn(_job_worker, dict(
+            (iface, (addrs, job, self.max_per_adapter, timeout, stand_down)) for iface, addrs in assignment.items()))
+        for kind, addr, value in self._messages(pipes, processes):
+            if kind == RESULT:
+                results[addr] = value
+                self.on_result(addr, value)
+            elif kind == ERROR:
+                errors[addr] = value
+                self.on_error(addr, value)
+
+        # gadgets of a worker that died
+        for addrs in assignment.values():
+            for addr in addrs:
+                if addr not in results and addr not in errors:
+                    errors[addr] = RuntimeError("worker of '{}' exited without result".format(addr))
+        return results, errors
+
+    def download_temperature_and_relative_humidity(self, timeout=None, addresses=None, columnar=True, **kwargs):
+        # columnar data crosses the process boundary as compact arrays
+        def download(gadget):
+            data = gadget.download_temperature_and_relative_humidity(timeout, columnar, **kwargs)
+            return {'temperature': data.get(gadget.Temperature),
+                    'relative_humidity': data.get(gadget.RelativeHumidity)}
+
+        # the coordinator timeout covers connecting and the handshake, the download watchdog ends a download
+        if timeout is None:
+            return self.run(download, addresses, stand_down=_downloading)
+        return self.run(download, addresses, timeout=timeout + (self.timeout or 0))
+
+    def on_result(self, addr, result):
+        pass
+
+    def on_error(self, addr, error):
+        pass
@@ -0,0 +1,50 @@
+import struct
+import time
+from collections import namedtuple
+
+from bluepy.btle import ScanEntry
+
+SENSIRION_COMPANY_ID = 0x06D5
+
+AdvertisementReading = namedtuple('AdvertisementReading',
+                                  ['addr', 'time', 'temperature', 'relative_humidity', 'rssi'])
+
+_HEADER = struct.Struct('<HBBH')
+_T_RH = struct.Struct('<HH')
+
+
+def _sht3x(t, rh):
+    return -45. + 175. * t / 65535., 100. * rh / 65535.
+
+
+def _sht4x(t, rh):
+    return -45. + 175. * t / 65535., -6. + 125. * rh / 65535.
+
+
+# Sensirion BLE advertisement sample types carrying temperature and humidity as the first two values
+SAMPLE_TYPES = {
+    4: _sht3x,
+    6: _sht4x,
+}
+
+
+def decode_manufacturer_data(data):
+    # company id, advertisement type, sample type, device id, samples...
+    if data is None or len(data) < _HEADER.size + _T_RH.size:
+        return None
+    company_id, advertisement_type, sample_type, _ = _HEADER.unpack_from(data)
+    if company_id != SENSIRION_COMPANY_ID or advertisement_type != 0:
+        return None
+    convert = SAMPLE_TYPES.get(sample_type)
+    if convert is None:
+        return None
+    return convert(*_T_RH.unpack_from(data, _HEADER.size))
+
+
+def decode_reading(dev: ScanEntry, timestamp_ms=None):
+    values = decode_manufacturer_data(dev.getValue(ScanEntry.MANUFACTURER))
+    if values is None:
+        return None
+    if timestamp_ms is None:
+        timestamp_ms = int(time.time() * 1000.)
+    return AdvertisementReading(dev.addr, timestamp_ms, values[0], values[1], dev.rssi)
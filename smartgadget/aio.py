@@ -0,0 +1,149 @@
+import asyncio
+import functools
+import logging
+
+from .device import SmartGadget
+from .scanner import SmartGadgetScanner
+
+log = logging.getLogger(__name__)
+
+
+class NotificationStream(object):
+
+    def __init__(self, gadget, characteristics, wait_slice=0.5, maxsize=0):
+        self._gadget = gadget
+        self._characteristics = characteristics
+        self._wait_slice = wait_slice
+        self._queue = asyncio.Queue(maxsize)
+        self._loop = None
+        self._pump = None
+        self._closed = False
+
+    def _listener(self, value, characteristic):
+        # called on the executor thread running waitForNotifications
+        self._loop.call_soon_threadsafe(self._put, (characteristic, value))
+
+    def _put(self, item):
+        if self._queue.full():
+            log.warning("notification queue of '{}' full, drop oldest value".format(self._gadget.addr))
+            self._queue.get_nowait()
+        self._queue.put_nowait(item)
+
+    async def _run_pump(self):
+        while not self._closed:
+            # through the gadget, a lost link clears its connected flag
+            await self._gadget._call(self._gadget.gadget.listen_for_notifications, self._wait_slice)
+
+    def open(self):
+        self._loop = asyncio.get_running_loop()
+        for ch in self._characteristics:
+            ch.register_listener(self._listener)
+        self._pump = asyncio.ensure_future(self._run_pump())
+        return self
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for ch in self._characteristics:
+            ch.unregister_listener(self._listener)
+        if self._pump is not None:
+            await self._pump
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        getter = asyncio.ensure_future(self._queue.get())
+        done, _ = await asyncio.wait([getter, self._pump], return_when=asyncio.FIRST_COMPLETED)
+        if getter not in done:
+            getter.cancel()
+            # the pump only ends on close or when the link failed
+            self._closed = True
+            self._pump.result()
+            raise StopAsyncIteration
+        return getter.result()
+
+    async def __aenter__(self):
+        return self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+class AsyncSmartGadget(object):
+
+    def __init__(self, device, executor=None):
+        if isinstance(device, SmartGadget):
+            self.gadget = device
+        else:
+            self.gadget = SmartGadget(device)
+        self.addr = self.gadget.addr
+        self._executor = executor
+        # bluepy peripherals are not thread-safe, only one call per gadget at a time
+        self._lock = asyncio.Lock()
+
+    async def _call(self, func, *args):
+        async with self._lock:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def __str__(self):
+        return str(self.gadget)
+
+    async def connect(self):
+        await self._call(self.gadget.connect)
+
+    async def disconnect(self):
+        await self._call(self.gadget.disconnect)
+
+    async def read_temperature(self):
+        return await self._call(self.gadget.read_temperature)
+
+    async def read_relative_humidity(self):
+        return await self._call(self.gadget.read_relative_humidity)
+
+    async def read_battery_level(self):
+        return await self._call(self.gadget.read_battery_level)
+
+    async def read_all(self, max_age=None):
+        return await self._call(self.gadget.read_all, max_age)
+
+    async def subscribe_temperature(self):
+        await self._call(self.gadget.subscribe_temperature)
+
+    async def subscribe_relative_humidity(self):
+        await self._call(self.gadget.subscribe_relative_humidity)
+
+    async def subscribe_battery_level(self):
+        await self._call(self.gadget.subscribe_battery_level)
+
+    async def download(self, timeout=None, **kwargs):
+        # the arguments of SmartGadget.download_temperature_and_relative_humidity, e.g. columnar or retries
+        return await self._call(functools.partial(self.gadget.download_temperature_and_relative_humidity,
+                                                  timeout, **kwargs))
+
+    def notifications(self, *characteristics, wait_slice=0.5, maxsize=0):
+        if not characteristics:
+            characteristics = self.gadget.subscribable_services
+        return NotificationStream(self, characteristics, wait_slice, maxsize)
+
+
+class AsyncSmartGadgetScanner(object):
+
+    def __init__(self, iface=0, executor=None):
+        self.scanner = SmartGadgetScanner(iface)
+        self.gadgets = {}
+        self._executor = executor
+
+    async def scan(self, timeout=10, passive=False):
+        gadgets = await asyncio.get_running_loop().run_in_executor(self._executor, self.scanner.scan,
+                                                                   timeout, passive)
+        for addr, gadget in gadgets.items():
+            if addr not in self.gadgets or self.gadgets[addr].gadget is not gadget:
+                self.gadgets[addr] = AsyncSmartGadget(gadget, self._executor)
+        for addr in list(self.gadgets):
+            if addr not in gadgets:
+                del self.gadgets[addr]
+        return self.gadgets
@@ -0,0 +1,205 @@
+import bisect
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'SGARC\x01'
+
+# number of columns, followed by the column names as length and utf-8 bytes
+HEADER = struct.Struct('<H')
+NAME = struct.Struct('<B')
+# time of the oldest sample in ms, interval in ms, number of samples,
+# followed by the float32 little endian values of every column
+BLOCK = struct.Struct('<qII')
+
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+Block = namedtuple('Block', ['start', 'end', 'interval', 'n_samples', 'offset'])
+ArchiveRange = namedtuple('ArchiveRange', ['times', 'columns'])
+
+
+class _Index(object):
+    # the blocks of an archive file sorted by time, they never overlap
+
+    def __init__(self, names, size):
+        self.names = names
+        self.size = size
+        self.blocks = []
+        self.starts = []
+
+    def add(self, block):
+        i = bisect.bisect_right(self.starts, block.start)
+        self.starts.insert(i, block.start)
+        self.blocks.insert(i, block)
+
+    def covers(self, t, tolerance=0):
+        # the sync time written before every download shifts the sample times a bit,
+        # a sample closer than tolerance to an archived one is the same sample
+        i = bisect.bisect_left(self.starts, t + tolerance) - 1 if tolerance else \
+            bisect.bisect_right(self.starts, t) - 1
+        return i >= 0 and (t < self.blocks[i].end + tolerance if tolerance else t <= self.blocks[i].end)
+
+    def overlapping(self, start, end):
+        # blocks with samples in [start, end)
+        i = max(0, bisect.bisect_right(self.starts, start) - 1)
+        j = bisect.bisect_left(self.starts, end)
+        return [block for block in self.blocks[i:j] if block.end >= start]
+
+
+class DownloadArchive(object):
+    # an append-only file of downloaded samples per gadget, queried by time through mmap
+    # a single process writes an archive, readers pick up appended blocks on their next query
+    BLOCK_SAMPLES = 4096
+
+    def __init__(self, directory, names=('temperature', 'relative_humidity')):
+        self.directory = directory
+        self.names = list(names)
+        self._indices = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, addr):
+        return os.path.join(self.directory, addr.replace(':', '').lower() + '.sga')
+
+    def _create(self, path):
+        with open(path, 'wb') as fp:
+            fp.write(MAGIC + HEADER.pack(len(self.names)))
+            for name in self.names:
+                data = name.encode('utf-8')
+                fp.write(NAME.pack(len(data)) + data)
+
+    def _index(self, addr, create=True):
+        # the index of the archive, blocks appended since the last call are read from their headers
+        path = self.path(addr)
+        if not os.path.exists(path):
+            if not create:
+                return None
+            self._create(path)
+        index = self._indices.get(addr)
+        size = os.path.getsize(path)
+        if index is not None and index.size == size:
+            return index
+
+        with open(path, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            if index is None:
+                if buffer[:len(MAGIC)] != MAGIC:
+                    raise ValueError("'{}' is not a smartgadget archive".format(path))
+                offset = len(MAGIC)
+                n_columns, = HEADER.unpack_from(buffer, offset)
+                offset += HEADER.size
+                names = []
+                for _ in range(n_columns):
+                    length, = NAME.unpack_from(buffer, offset)
+                    offset += NAME.size
+                    names.append(buffer[offset:offset + length].decode('utf-8'))
+                    offset += length
+                index = _Index(names, offset)
+
+            offset = index.size
+            while offset + BLOCK.size <= size:
+                start, interval, n_samples = BLOCK.unpack_from(buffer, offset)
+                block_size = BLOCK.size + 4 * n_samples * len(index.names)
+                if offset + block_size > size:
+                    break
+                index.add(Block(start, start + (n_samples - 1) * interval, interval, n_samples, offset))
+                offset += block_size
+            if offset != size:
+                log.warning("archive '{}' ends with an incomplete block".format(path))
+            index.size = offset
+        self._indices[addr] = index
+        return index
+
+    def append(self, addr, frame):
+        # append the samples of an AlignedFrame that are not archived yet, returns their number
+        with self._lock:
+            index = self._index(addr)
+            columns = [frame.columns.get(name) for name in index.names]
+            valid = [frame.valid.get(name) for name in index.names]
+
+            # runs of consecutive samples, from the oldest to the newest
+            tolerance = frame.interval / 2.
+            runs = []
+            run = []
+            for i in range(frame.n_samples - 1, -1, -1):
+                t = frame.newest_time - i * frame.interval
+                if not any(v is not None and v[i] for v in valid) or index.covers(t, tolerance):
+                    if run:
+                        runs.append(run)
+                        run = []
+                    continue
+                run.append(i)
+                if len(run) == self.BLOCK_SAMPLES:
+                    runs.append(run)
+                    run = []
+            if run:
+                runs.append(run)
+            if not runs:
+                return 0
+
+            nan = float('nan')
+            with open(self.path(addr), 'r+b') as fp:
+                # an incomplete block of an interrupted append is overwritten
+                fp.seek(index.size)
+                for run in runs:
+                    start = frame.newest_time - run[0] * frame.interval
+                    fp.write(BLOCK.pack(start, frame.interval, len(run)))
+                    for column, v in zip(columns, valid):
+                        values = array('f', (column[i] if column is not None and v[i] else nan for i in run))
+                        if not _LITTLE_ENDIAN:
+                            values.byteswap()
+                        fp.write(values.tobytes())
+                    index.add(Block(start, start + (len(run) - 1) * frame.interval, frame.interval, len(run),
+                                    index.size))
+                    index.size = fp.tell()
+                fp.truncate()
+
+        n = sum(len(run) for run in runs)
+        log.debug("archived {} samples of '{}' in {} blocks".format(n, addr, len(runs)))
+        return n
+
+    def blocks(self, addr):
+        with self._lock:
+            index = self._index(addr, create=False)
+            return [] if index is None else list(index.blocks)
+
+    def query(self, addr, start=None, end=None):
+        # the samples with start <= time < end in ms, only the blocks in the range are read
+        with self._lock:
+            index = self._index(addr, create=False)
+            start = -2 ** 63 if start is None else start
+            end = 2 ** 63 - 1 if end is None else end
+            blocks = [] if index is None else index.overlapping(start, end)
+            names = self.names if index is None else index.names
+
+        times = array('q')
+        columns = dict((name, array('f')) for name in names)
+        if not blocks:
+            return ArchiveRange(times, columns)
+        with open(self.path(addr), 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            view = memoryview(buffer)
+            try:
+                for block in blocks:
+                    # first and last sample of the block within the range
+                    first = max(0, -((block.start - start) // block.interval))
+                    last = min(block.n_samples, (end - block.start + block.interval - 1) // block.interval)
+                    if first >= last:
+                        continue
+                    times.extend(range(block.start + first * block.interval, block.start + last * block.interval,
+                                       block.interval))
+                    offset = block.offset + BLOCK.size
+                    for name in names:
+                        columns[name].frombytes(view[offset + 4 * first:offset + 4 * last])
+                        offset += 4 * block.n_samples
+            finally:
+                view.release()
+        if not _LITTLE_ENDIAN:
+            for values in columns.values():
+                values.byteswap()
+        return ArchiveRange(times, columns)
@@ -0,0 +1,25 @@
+from .store import JSONStore
+
+
+class HandleCache(JSONStore):
+
+    def __init__(self, path=None):
+        JSONStore.__init__(self, path, 'cached handles')
+
+    def put(self, addr, entry):
+        with self._lock:
+            self._entries[addr] = entry
+            self._save()
+
+    def put_service(self, addr, uuid, entry):
+        # services are discovered one by one, each is cached as soon as it is known
+        with self._lock:
+            entries = dict(self._entries.get(addr) or {})
+            entries[uuid] = entry
+            self._entries[addr] = entries
+            self._save()
+
+    def invalidate(self, addr):
+        with self._lock:
+            if self._entries.pop(addr, None) is not None:
+                self._save()
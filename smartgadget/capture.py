@@ -0,0 +1,195 @@
+import json
+import logging
+import struct
+import time
+from collections import defaultdict, deque, namedtuple
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'SGCAP\x01'
+
+CONNECTED = 0
+NOTIFICATION = 1
+READ = 2
+WRITE = 3
+
+# kind, monotonic time in seconds, handle, payload length
+RECORD = struct.Struct('<BdHH')
+
+CaptureRecord = namedtuple('CaptureRecord', ['kind', 'time', 'handle', 'data'])
+
+
+class NotificationCapture(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.n_records = 0
+        self._fp = open(path, 'wb')
+        self._fp.write(MAGIC)
+
+    def _record(self, kind, handle, data):
+        self._fp.write(RECORD.pack(kind, time.monotonic(), handle, len(data)))
+        self._fp.write(data)
+        self.n_records += 1
+
+    def connected(self, addr, services):
+        # the handle table of the gadget, a replay connects with it instead of a discovery
+        self._record(CONNECTED, 0, json.dumps({'addr': addr, 'services': services}).encode('utf-8'))
+
+    def notification(self, handle, data):
+        self._record(NOTIFICATION, handle, data)
+
+    def read(self, handle, data):
+        self._record(READ, handle, data)
+
+    def write(self, handle, data):
+        self._record(WRITE, handle, data)
+
+    def flush(self):
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+        log.debug("captured {} records to '{}'".format(self.n_records, self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_capture(path):
+    with open(path, 'rb') as fp:
+        buffer = fp.read()
+    if not buffer.startswith(MAGIC):
+        raise ValueError("'{}' is not a smartgadget capture".format(path))
+    view = memoryview(buffer)
+    offset = len(MAGIC)
+    while offset + RECORD.size <= len(buffer):
+        kind, t, handle, length = RECORD.unpack_from(buffer, offset)
+        offset += RECORD.size
+        if offset + length > len(buffer):
+            log.warning("capture '{}' is truncated".format(path))
+            break
+        yield CaptureRecord(kind, t, handle, bytes(view[offset:offset + length]))
+        offset += length
+
+
+def replay(path, handle_notification, realtime=True, speed=1.):
+    # feed the captured notifications to handle_notification(handle, data), returns their number
+    t0 = time.monotonic()
+    first = None
+    n = 0
+    for record in read_capture(path):
+        if record.kind != NOTIFICATION:
+            continue
+        if first is None:
+            first = record.time
+        if realtime:
+            delay = (record.time - first) / speed - (time.monotonic() - t0)
+            if delay > 0:
+                time.sleep(delay)
+        handle_notification(record.handle, record.data)
+        n += 1
+    return n
+
+
+class ReplayPeripheral(object):
+    # plays a capture back as a peripheral, reads are answered with the captured values per handle
+
+    def __init__(self, path, realtime=False, speed=1.):
+        self.addr = None
+        self.services = None
+        self.delegate = None
+        self.connected = True
+        self.realtime = realtime
+        self.speed = speed
+
+        self._notifications = deque()
+        self._reads = defaultdict(deque)
+        self._writes = defaultdict(deque)
+        for record in read_capture(path):
+            if record.kind == CONNECTED:
+                if self.services is None:
+                    connection = json.loads(record.data.decode('utf-8'))
+                    self.addr, self.services = connection['addr'], connection['services']
+            elif record.kind == NOTIFICATION:
+                self._notifications.append(record)
+            elif record.kind == READ:
+                self._reads[record.handle].append(record)
+            elif record.kind == WRITE:
+                self._writes[record.handle].append(record)
+        if self.services is None:
+            raise ValueError("capture '{}' has no connection record".format(path))
+
+        self._last_values = {}
+        self._time = min([q[0].time for q in [self._notifications] + list(self._reads.values()) if q] or [0.])
+
+    def clock(self):
+        # capture time of the latest replayed record
+        return self._time
+
+    def _advance(self, record):
+        self._time = max(self._time, record.time)
+
+    def withDelegate(self, delegate):
+        self.delegate = delegate
+        return self
+
+    def status(self):
+        return {'rsp': ['stat'], 'state': ['conn']}
+
+    def disconnect(self):
+        self.connected = False
+
+    def readCharacteristic(self, handle):
+        queue = self._reads.get(handle)
+        if queue:
+            record = queue.popleft()
+            self._advance(record)
+            self._last_values[handle] = record.data
+        # the gadget answers the same again once the captured reads are used up
+        return self._last_values.get(handle, b'')
+
+    def writeCharacteristic(self, handle, val, withResponse=False):
+        queue = self._writes.get(handle)
+        if queue:
+            self._advance(queue.popleft())
+        return {'rsp': ['wr']}
+
+    @property
+    def remaining(self):
+        return len(self._notifications)
+
+    def _wait(self, seconds):
+        if self.realtime and seconds > 0:
+            time.sleep(seconds / self.speed)
+
+    def waitForNotifications(self, timeout):
+        # the capture time advances like the time of a real wait, so timeouts fire as they did
+        due = self._notifications[0].time if self._notifications else float('inf')
+        if due - self._time > timeout:
+            self._wait(timeout)
+            self._time += timeout
+            return False
+        self._wait(due - self._time)
+        record = self._notifications.popleft()
+        self._advance(record)
+        if self.delegate is not None:
+            self.delegate.handleNotification(record.handle, record.data)
+        return True
+
+
+def replay_gadget(path, realtime=False, speed=1.):
+    # a connected SmartGadget playing back the capture, e.g. to repeat a download offline
+    from .cache import HandleCache
+    from .device import SmartGadget
+
+    peripheral = ReplayPeripheral(path, realtime, speed)
+    gadget = SmartGadget(peripheral.addr, handle_cache=HandleCache())
+    gadget.handle_cache.put(peripheral.addr, peripheral.services)
+    gadget.peripheral_factory = lambda *args: peripheral
+    gadget.connect()
+    gadget.Logging.clock = peripheral.clock
+    return gadget
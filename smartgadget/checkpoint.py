@@ -0,0 +1,20 @@
+from .store import JSONStore
+
+
+class DownloadCheckpoint(JSONStore):
+
+    def __init__(self, path=None):
+        JSONStore.__init__(self, path, 'download checkpoints')
+
+    def update(self, addr, timestamp_ms):
+        with self._lock:
+            # never move a checkpoint backwards, e.g. after a windowed download of older data
+            if addr in self._entries and self._entries[addr] >= timestamp_ms:
+                return
+            self._entries[addr] = timestamp_ms
+            self._save()
+
+    def reset(self, addr):
+        with self._lock:
+            self._entries.pop(addr, None)
+            self._save()
@@ -0,0 +1,208 @@
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+
+# the smartgadget modules pull in bluepy and concurrent.futures, they are imported by the commands
+# that need them so that a one-shot invocation starts fast
+
+log = logging.getLogger(__name__)
+
+
+class NDJSONWriter(object):
+
+    def __init__(self, stream=None):
+        self.stream = sys.stdout if stream is None else stream
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            self.stream.write(line)
+            self.stream.flush()
+
+    def write_many(self, records):
+        lines = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+        with self._lock:
+            self.stream.write(lines)
+            self.stream.flush()
+
+
+def now_ms():
+    return int(time.time() * 1000.)
+
+
+def scan(args, out):
+    from .scanner import SmartGadgetScanner
+
+    scanner = SmartGadgetScanner(iface=args.iface)
+    for event in scanner.scan_events(args.last_seen_timeout, timeout=args.timeout, passive=args.passive):
+        record = {'event': event.kind, 'address': event.gadget.addr, 'time': now_ms(),
+                  'rssi': getattr(event.gadget, 'rssi', None)}
+        if event.reading is not None:
+            record['temperature'] = event.reading.temperature
+            record['relative_humidity'] = event.reading.relative_humidity
+        out.write(record)
+    return 0
+
+
+def gadgets(args):
+    from .device import SmartGadget
+    from .scanner import SmartGadgetScanner
+
+    addresses = args.addresses
+    if not addresses:
+        log.info("scan {}s for gadgets...".format(args.scan))
+        addresses = sorted(SmartGadgetScanner(iface=args.iface).scan(args.scan))
+    result = []
+    for addr in addresses:
+        gadget = SmartGadget(addr)
+        gadget.iface = args.iface
+        result.append(gadget)
+    return result
+
+
+def run_fleet(args, out, job, timeout, connect_all=False, stand_down=None):
+    from .fleet import SmartGadgetFleet
+
+    devices = gadgets(args)
+    if not devices:
+        log.warning("no gadgets found")
+        return 1
+    # jobs that hold the connection for the whole time need a worker per gadget
+    max_connections = max(args.max_connections, len(devices)) if connect_all else args.max_connections
+    fleet = SmartGadgetFleet(devices, max_workers=max_connections, max_per_adapter=max_connections,
+                             timeout=timeout)
+    results, errors = fleet.run(job, stand_down=stand_down)
+    for addr, error in sorted(errors.items()):
+        out.write({'address': addr, 'time': now_ms(), 'error': str(error) or type(error).__name__})
+    return 1 if errors else 0
+
+
+def read(args, out):
+    def job(gadget):
+        snapshot = gadget.read_all()
+        out.write({'address': gadget.addr,
+                   'time': snapshot.time,
+                   'temperature': snapshot.temperature,
+                   'relative_humidity': snapshot.relative_humidity,
+                   'battery': snapshot.battery})
+
+    return run_fleet(args, out, job, args.timeout)
+
+
+def monitor(args, out):
+    names = {}
+
+    def listener(value, characteristic):
+        out.write({'address': names[characteristic][0], 'time': now_ms(), names[characteristic][1]: value})
+
+    def job(gadget):
+        for name, characteristic in (('temperature', gadget.Temperature),
+                                     ('relative_humidity', gadget.RelativeHumidity)):
+            names[characteristic] = (gadget.addr, name)
+            characteristic.register_listener(listener)
+            characteristic.subscribe()
+        gadget.listen_for_notifications(args.seconds)
+
+    return run_fleet(args, out, job, None if args.seconds is None else args.seconds + args.timeout,
+                     connect_all=True)
+
+
+def download(args, out):
+    checkpoint = None
+    if args.checkpoint is not None:
+        from .checkpoint import DownloadCheckpoint
+        checkpoint = DownloadCheckpoint(args.checkpoint)
+    archive = None
+    if args.archive is not None:
+        from .archive import DownloadArchive
+        archive = DownloadArchive(args.archive)
+
+    def job(gadget):
+        data = gadget.download_temperature_and_relative_humidity(args.download_timeout, retries=args.retries,
+                                                                 since=args.since, checkpoint=checkpoint,
+                                                                 archive=archive)
+        for characteristic, name in ((gadget.Temperature, 'temperature'),
+                                     (gadget.RelativeHumidity, 'relative_humidity')):
+            out.write_many({'address': gadget.addr, 'sample': sample, 'time': t, name: value}
+                           for sample, t, value in data.get(characteristic, []))
+        out.write({'address': gadget.addr, 'time': now_ms(), 'download': data.status,
+                   'expected': data.n_expected, 'missing': data.n_missing, 'duration': round(data.duration, 3)})
+        return len(data)
+
+    if args.download_timeout is None:
+        # -t covers connecting and the handshake, the download watchdog ends the download
+        from .fleet import _downloading
+        return run_fleet(args, out, job, args.timeout, stand_down=_downloading)
+    return run_fleet(args, out, job, args.download_timeout + args.timeout)
+
+
+def parser():
+    p = argparse.ArgumentParser(prog='smartgadget',
+                                description="Access Sensirion BLE SmartGadgets, results are written as NDJSON")
+    p.add_argument('--version', action='store_true', help="print the version and exit")
+    p.add_argument('-v', '--verbose', action='count', default=0, help="log to stderr, repeat for debug")
+    p.add_argument('-i', '--iface', type=int, default=0, help="bluetooth adapter, 0 for hci0")
+    commands = p.add_subparsers(dest='command')
+
+    s = commands.add_parser('scan', help="stream appearing and disappearing gadgets and their advertised readings")
+    s.add_argument('-t', '--timeout', type=float, default=10., help="seconds to scan, 0 to scan forever")
+    s.add_argument('--last-seen-timeout', type=float, default=30.)
+    s.add_argument('--passive', action='store_true')
+    s.set_defaults(run=scan)
+
+    def connecting(name, run, help):
+        c = commands.add_parser(name, help=help)
+        c.add_argument('addresses', nargs='*', help="gadget addresses, scan for gadgets if none is given")
+        c.add_argument('--scan', type=float, default=10., help="seconds to scan when no address is given")
+        c.add_argument('-n', '--max-connections', type=int, default=4, help="gadgets connected at the same time")
+        c.add_argument('-t', '--timeout', type=float, default=30., help="seconds allowed per gadget")
+        c.set_defaults(run=run)
+        return c
+
+    connecting('read', read, "read temperature, humidity and battery level")
+
+    m = connecting('monitor', monitor, "stream live temperature and humidity notifications")
+    m.add_argument('-s', '--seconds', type=float, default=None, help="seconds to monitor, default forever")
+
+    d = connecting('download', download, "download the logged samples, one line per sample")
+    d.add_argument('--since', type=int, default=None, help="oldest timestamp in ms")
+    d.add_argument('--checkpoint', default=None, help="file to resume downloads from")
+    d.add_argument('--archive', default=None, help="directory to archive the downloaded samples in")
+    d.add_argument('--retries', type=int, default=None, help="re-download passes for missed samples")
+    d.add_argument('--download-timeout', type=float, default=None,
+                   help="hard limit in seconds, by default the limit follows the download throughput")
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+
+    if args.version:
+        from . import __version__
+        print(__version__)
+        return 0
+    if args.command is None:
+        parser().print_usage(sys.stderr)
+        return 2
+
+    logging.basicConfig(stream=sys.stderr,
+                        level=logging.WARNING - 10 * min(args.verbose, 2),
+                        format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    if args.command == 'scan' and args.timeout == 0:
+        args.timeout = None
+
+    try:
+        return args.run(args, NDJSONWriter())
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:
+        # the consumer of the stream went away, e.g. head
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
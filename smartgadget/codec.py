@@ -0,0 +1,90 @@
+import struct
+
+
+class Codec(object):
+    # converts the value of a characteristic with a struct compiled once
+
+    def __init__(self, byte_format):
+        self.byte_format = byte_format
+        self.struct = struct.Struct(byte_format)
+        self.size = self.struct.size
+        self.n_values = len(self.struct.unpack(bytes(self.size)))
+
+    def decode(self, data):
+        return self.struct.unpack(data)
+
+    def encode(self, value):
+        return self.struct.pack(*value)
+
+    def count(self, nbytes):
+        # number of complete values in nbytes
+        return nbytes // self.size
+
+    def decode_many(self, data, offset=0, n=None):
+        # values packed back to back from offset on, sliced without copying the payload
+        view = memoryview(data)[offset:]
+        if n is None:
+            n = len(view) // self.size
+        return self.struct.iter_unpack(view[:n * self.size])
+
+    def __repr__(self):
+        return "{}('{}')".format(type(self).__name__, self.byte_format)
+
+
+class ScalarCodec(Codec):
+    # a single value per payload, decoded without the tuple
+
+    def __init__(self, byte_format):
+        Codec.__init__(self, byte_format)
+        if self.n_values != 1:
+            raise ValueError("'{}' is not a single value format".format(byte_format))
+
+    def decode(self, data):
+        return self.struct.unpack(data)[0]
+
+    def encode(self, value):
+        return self.struct.pack(value)
+
+    def decode_many(self, data, offset=0, n=None):
+        return [v for v, in Codec.decode_many(self, data, offset, n)]
+
+
+class RawCodec(object):
+    # characteristics without a byte format pass the bytes through
+    byte_format = None
+    size = 1
+    n_values = 1
+
+    def decode(self, data):
+        return data
+
+    def encode(self, value):
+        return value
+
+    def count(self, nbytes):
+        return nbytes
+
+
+RAW = RawCodec()
+UINT8 = ScalarCodec('<B')
+UINT32 = ScalarCodec('<I')
+UINT64 = ScalarCodec('<Q')
+FLOAT32 = ScalarCodec('<f')
+
+# the sequence number in front of every logger packet
+SEQUENCE_NUMBER = UINT32
+
+_codecs = dict((codec.byte_format, codec) for codec in (UINT8, UINT32, UINT64, FLOAT32))
+
+
+def codec_for(byte_format):
+    # shared codec instance of a byte format
+    if not byte_format:
+        return RAW
+    codec = _codecs.get(byte_format)
+    if codec is None:
+        codec = Codec(byte_format)
+        if codec.n_values == 1:
+            codec = ScalarCodec(byte_format)
+        _codecs[byte_format] = codec
+    return codec
@@ -0,0 +1,129 @@
+import logging
+import random
+import threading
+import time
+
+from bluepy.btle import BTLEException, BTLEDisconnectError, BTLEInternalError
+
+log = logging.getLogger(__name__)
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+class ManagedSmartGadget(object):
+
+    def __init__(self, gadget, min_backoff=1., max_backoff=60., jitter=0.5, max_retries=None):
+        self.gadget = gadget
+        self.addr = gadget.addr
+
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.max_retries = max_retries
+
+        self.reconnects = 0
+        self._closed = threading.Event()
+        self._subscriptions = []
+
+    @property
+    def connected(self):
+        return self.gadget.connected
+
+    def _backoff(self, attempt):
+        delay = min(self.max_backoff, self.min_backoff * 2 ** attempt)
+        # spread reconnects of gadgets that dropped at the same time
+        return delay * (1. - self.jitter * random.random())
+
+    def connect(self):
+        attempt = 0
+        while not self._closed.is_set():
+            try:
+                self.gadget.connect()
+                for characteristic in self._subscriptions:
+                    characteristic.subscribe()
+                break
+            except BTLEException as e:
+                self._drop_link()
+                if self.max_retries is not None and attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                log.warning("connect to '{}' failed ({}), retry in {:.1f}s...".format(self.addr, e, delay))
+                attempt += 1
+                self._closed.wait(delay)
+        else:
+            raise ConnectionClosed("Connection to '{}' was closed".format(self.addr))
+
+        self.on_connected()
+
+    def _drop_link(self):
+        self.gadget.connected = False
+        try:
+            self.gadget.disconnect()
+        except BTLEException:
+            pass
+
+    def _link_lost(self, e):
+        log.warning("lost link to '{}' ({}), reconnect...".format(self.addr, e))
+        # remember the subscriptions to restore them on the new link
+        self._subscriptions = [ch for ch in self.gadget.subscribable_services + [self.gadget.Battery]
+                               if ch._subscribed is True]
+        self._drop_link()
+        self.on_disconnected()
+        self.reconnects += 1
+        self.connect()
+
+    def call(self, func, *args, **kwargs):
+        while True:
+            if not self.gadget.connected:
+                self.connect()
+            try:
+                return func(*args, **kwargs)
+            except (BTLEDisconnectError, BTLEInternalError) as e:
+                # both are raised by bluepy when the link or its helper process went away
+                if self._closed.is_set():
+                    raise
+                self._link_lost(e)
+
+    def close(self):
+        self._closed.set()
+        self.gadget.disconnect()
+
+    def on_connected(self):
+        pass
+
+    def on_disconnected(self):
+        pass
+
+    def subscribe_temperature(self):
+        self.call(self.gadget.subscribe_temperature)
+
+    def subscribe_relative_humidity(self):
+        self.call(self.gadget.subscribe_relative_humidity)
+
+    def subscribe_battery_level(self):
+        self.call(self.gadget.subscribe_battery_level)
+
+    def read_temperature(self):
+        return self.call(self.gadget.read_temperature)
+
+    def read_relative_humidity(self):
+        return self.call(self.gadget.read_relative_humidity)
+
+    def read_battery_level(self):
+        return self.call(self.gadget.read_battery_level)
+
+    def read_all(self, max_age=None):
+        return self.call(self.gadget.read_all, max_age)
+
+    def download_temperature_and_relative_humidity(self, *args, **kwargs):
+        return self.call(self.gadget.download_temperature_and_relative_humidity, *args, **kwargs)
+
+    def listen_for_notifications(self, seconds=None, until=None, stop=None):
+        if seconds is None:
+            return self.call(self.gadget.listen_for_notifications, None, until, stop)
+        # keep the overall duration when the link is restored in between
+        deadline = time.monotonic() + seconds
+        return self.call(lambda: self.gadget.listen_for_notifications(max(0., deadline - time.monotonic()),
+                                                                      until, stop))
@@ -0,0 +1,188 @@
+import sys
+from array import array
+
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+class ColumnarData(object):
+
+    def __init__(self, n_samples, newest_time, interval, byte_format='<f'):
+
+        self.n_samples = n_samples
+        self.newest_time = newest_time
+        self.interval = interval
+
+        # the struct format of the characteristic without the byte order prefix is a valid array typecode
+        self.typecode = byte_format.lstrip('<>=!@')
+        self.values = array(self.typecode, bytes(array(self.typecode).itemsize * n_samples))
+        self.received = bytearray(n_samples)
+        self.n_received = 0
+
+        self._raw = memoryview(self.values).cast('B')
+
+    def __getstate__(self):
+        # pickled as the raw buffers, e.g. to send a download to another process
+        state = self.__dict__.copy()
+        del state['_raw']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._raw = memoryview(self.values).cast('B')
+
+    def __len__(self):
+        return self.n_samples
+
+    def put(self, index, payload):
+        # copy the little endian payload of consecutive samples starting at sample index into the buffer
+        itemsize = self.values.itemsize
+        n = len(payload) // itemsize
+        if index >= self.n_samples or n == 0:
+            return 0
+        n = min(n, self.n_samples - index)
+
+        if _LITTLE_ENDIAN:
+            self._raw[index * itemsize:(index + n) * itemsize] = payload[:n * itemsize]
+        else:
+            chunk = array(self.typecode)
+            chunk.frombytes(payload[:n * itemsize])
+            chunk.byteswap()
+            self.values[index:index + n] = chunk
+
+        self.n_received += n - self.received[index:index + n].count(1)
+        self.received[index:index + n] = b'\x01' * n
+        return n
+
+    @property
+    def times(self):
+        if self.n_samples == 0:
+            return array('q')
+        return array('q', range(self.newest_time,
+                                self.newest_time - self.n_samples * self.interval,
+                                -self.interval))
+
+    @property
+    def missing(self):
+        return [i for i, r in enumerate(self.received) if not r]
+
+    @property
+    def complete(self):
+        return self.n_received == self.n_samples
+
+    def to_numpy(self):
+        import numpy as np
+        values = np.frombuffer(self.values, dtype=self.values.typecode)
+        mask = np.frombuffer(self.received, dtype=np.uint8) == 0
+        times = self.newest_time - np.arange(self.n_samples, dtype=np.int64) * self.interval
+        return times, values, mask
+
+
+class AlignedFrame(object):
+    # the channels of one download on their shared sample axis, sample 0 is the newest
+    # float columns hold nan where a sample is missing, valid marks the received samples
+
+    def __init__(self, n_samples, newest_time, interval, columns, valid):
+        self.n_samples = n_samples
+        self.newest_time = newest_time
+        self.interval = interval
+        self.columns = columns
+        self.valid = valid
+
+    @classmethod
+    def from_download(cls, data, names, n_samples, newest_time, interval):
+        # data {characteristic: ColumnarData or [(sample, time, value)]}, names {characteristic: column name}
+        columns = {}
+        valid = {}
+        for characteristic, channel in data.items():
+            name = names.get(characteristic, str(characteristic))
+            if isinstance(channel, ColumnarData):
+                # the buffers of the download are used as they are
+                values, received = channel.values, channel.received
+            else:
+                values, received = _align(channel, n_samples, characteristic.byte_format)
+            if values.typecode in 'fd':
+                _fill_missing(values, received)
+            columns[name] = values
+            valid[name] = received
+        return cls(n_samples, newest_time, interval, columns, valid)
+
+    def __len__(self):
+        return self.n_samples
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def names(self):
+        return sorted(self.columns)
+
+    @property
+    def times(self):
+        if self.n_samples == 0:
+            return array('q')
+        return array('q', range(self.newest_time,
+                                self.newest_time - self.n_samples * self.interval,
+                                -self.interval))
+
+    def rows(self):
+        # (sample, time, values...) of the samples received on every channel
+        names = self.names
+        columns = [self.columns[name] for name in names]
+        valid = [self.valid[name] for name in names]
+        for i in range(self.n_samples):
+            if all(v[i] for v in valid):
+                yield (i, self.newest_time - i * self.interval) + tuple(c[i] for c in columns)
+
+    def buffers(self):
+        # {name: (values, validity)}, both exported through the buffer protocol without a copy,
+        # the validity holds a byte per sample instead of the bits of an arrow bitmap
+        return dict((name, (memoryview(self.columns[name]), memoryview(self.valid[name])))
+                    for name in self.columns)
+
+    def to_numpy(self):
+        # {'time': int64 ms, name: values, name + '_valid': bool}, the columns are views on the buffers
+        import numpy as np
+        arrays = {'time': self.newest_time - np.arange(self.n_samples, dtype=np.int64) * self.interval}
+        for name, values in self.columns.items():
+            arrays[name] = np.frombuffer(values, dtype=values.typecode)
+            arrays[name + '_valid'] = np.frombuffer(self.valid[name], dtype=np.bool_)
+        return arrays
+
+    def to_pandas(self):
+        import pandas as pd
+        arrays = self.to_numpy()
+        index = pd.to_datetime(arrays.pop('time'), unit='ms', utc=True)
+        return pd.DataFrame(dict((name, arrays[name]) for name in self.names), index=index)
+
+    def to_arrow(self):
+        # a pyarrow table on the value buffers, only the validity bitmaps are packed
+        import numpy as np
+        import pyarrow as pa
+        arrays = [pa.array(self.newest_time - np.arange(self.n_samples, dtype=np.int64) * self.interval,
+                           type=pa.timestamp('ms', tz='UTC'))]
+        for name in self.names:
+            values = self.columns[name]
+            bitmap = np.packbits(np.frombuffer(self.valid[name], dtype=np.bool_), bitorder='little')
+            arrays.append(pa.Array.from_buffers(pa.from_numpy_dtype(np.dtype(values.typecode)), self.n_samples,
+                                                [pa.py_buffer(bitmap), pa.py_buffer(values)]))
+        return pa.Table.from_arrays(arrays, names=['time'] + self.names)
+
+
+def _align(channel, n_samples, byte_format):
+    # one pass over the (sample, time, value) tuples of a list download
+    typecode = byte_format.lstrip('<>=!@') if byte_format else 'd'
+    values = array(typecode, bytes(array(typecode).itemsize * n_samples))
+    received = bytearray(n_samples)
+    for sample, _, value in channel:
+        if 0 <= sample < n_samples:
+            values[sample] = value
+            received[sample] = 1
+    return values, received
+
+
+def _fill_missing(values, received):
+    nan = float('nan')
+    i = received.find(0)
+    while i >= 0:
+        values[i] = nan
+        i = received.find(0, i + 1)
@@ -1,22 +1,53 @@
 import binascii
+import functools
 import logging
+import struct
+import threading
 import time
+from collections import namedtuple
 
 from bluepy.btle import DefaultDelegate, \
-    Peripheral, BTLEException, ScanEntry, \
+    Peripheral, BTLEException, BTLEDisconnectError, BTLEGattError, BTLEInternalError, ScanEntry, \
     ADDR_TYPE_RANDOM
 
+from .metrics import GadgetMetrics
 from .services import Float32Service, Uint8Service, LoggingService
+from .watchdog import DownloadWatchdog
 
 log = logging.getLogger(__name__)
 
+Snapshot = namedtuple('Snapshot', ['addr', 'time', 'temperature', 'relative_humidity', 'battery'])
+
+
+def _tracks_link(method):
+    # is_connected() does not probe the helper, a call that lost the link clears the connected flag
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except (BTLEDisconnectError, BTLEInternalError) as e:
+            self._link_lost(e)
+            raise
+    return wrapper
+
 
 class SmartGadget(DefaultDelegate):
+    # upper bound for a single wait, the latency of stop_listening() from another thread
+    MAX_NOTIFICATION_WAIT = 0.1
+    # creates the connection, replaced by a simulated peripheral in tests and benchmarks
+    peripheral_factory = Peripheral
 
-    def __init__(self, device):
+    def __init__(self, device, handle_cache=None, dispatcher=None, capture=None, metrics=None):
 
         self.present = True
+        self.connected = False
         self.peripheral = None
+        # the bluepy peripheral while it connects
+        self._connecting = None
+        # last reading decoded from the advertisement data
+        self.reading = None
+        self.handle_cache = handle_cache
+        self._stop_listening = threading.Event()
 
         if isinstance(device, ScanEntry):
             self.addr, self.addrType, self.iface = device.addr, device.addrType, device.iface
@@ -36,85 +67,267 @@ class SmartGadget(DefaultDelegate):
         self.Logging = LoggingService("0000f234-b38d-4985-720e-0f993a68ee41",
                                       subscribables=self.subscribable_services)
 
+        self.services = [self.Temperature, self.RelativeHumidity, self.Battery, self.Logging]
+
+        self._handlers = {}
+        # labelled metrics of this gadget when a MetricsRegistry is given
+        self.metrics = None if metrics is None else GadgetMetrics(metrics, self.addr)
+        self.Logging.metrics = self.metrics
+        for name, characteristic in (('temperature', self.Temperature),
+                                     ('relative_humidity', self.RelativeHumidity),
+                                     ('battery', self.Battery)):
+            characteristic.dispatcher = dispatcher
+            characteristic.metrics = None if self.metrics is None else self.metrics.service(name)
+        self.set_capture(capture)
+
+    def set_capture(self, capture):
+        # record notifications and the values read and written to a capture file, None stops recording
+        self.capture = capture
+        self.Logging.capture = capture
+        for service in self.services:
+            for characteristic in service.characteristics:
+                characteristic.capture = capture
+
     def connect(self):
         log.info("connect to '{}'...".format(self.addr))
-        self.peripheral = Peripheral(self.addr, self.addrType, self.iface)
-        self.peripheral.withDelegate(self)
-        self.Temperature.connect(self.peripheral)
-        self.RelativeHumidity.connect(self.peripheral)
-        self.Battery.connect(self.peripheral)
-        self.Logging.connect(self.peripheral)
+        t0 = time.monotonic()
+        # a stop_listening() of an earlier connection does not end the listening on this one
+        self._stop_listening.clear()
+        try:
+            self.peripheral = self._create_peripheral()
+            self.peripheral.withDelegate(self)
+            if not self._connect_cached():
+                # the services are discovered when they are used first
+                for service in self.services:
+                    service.attach(self.peripheral, self._service_resolved)
+            if self.capture is not None:
+                # a replay needs the whole handle table
+                for service in self.services:
+                    service.resolve()
+        except Exception:
+            if self.metrics is not None:
+                self.metrics.connect_failed()
+            raise
+        self._update_handlers()
+        self.connected = True
+        if self.metrics is not None:
+            self.metrics.connect_finished(time.monotonic() - t0)
+        if self.capture is not None:
+            self.capture.connected(self.addr, self.service_entries())
         log.info("connected to '{}'!".format(self.addr))
 
-    def is_connected(self):
-        if self.peripheral is None: return False
+    def _update_handlers(self):
+        self._handlers = dict((characteristic.valHandle, characteristic)
+                              for characteristic in self.subscribable_services + [self.Battery]
+                              if characteristic.peripheral is not None)
+
+    def _service_resolved(self, service):
+        self._update_handlers()
+        if self.handle_cache is not None:
+            self.handle_cache.put_service(self.addr, str(service.service_uuid), service.service_entry())
+
+    def service_entries(self):
+        return dict((str(service.service_uuid), service.service_entry()) for service in self.services)
+
+    def _connect_cached(self):
+        entry = None if self.handle_cache is None else self.handle_cache.get(self.addr)
+        cached = [] if entry is None else [s for s in self.services if str(s.service_uuid) in entry]
+        if not cached:
+            return False
+        try:
+            for service in self.services:
+                if service in cached:
+                    service.connect_cached(self.peripheral, entry[str(service.service_uuid)])
+                else:
+                    # not used on an earlier connection, discovered on first use
+                    service.attach(self.peripheral, self._service_resolved)
+            # a single read tells whether the cached handles still match the gadget
+            if self.Logging in cached:
+                if self.Logging.LoggerIntervalMs.read() <= 0:
+                    raise ValueError("invalid logger interval")
+            else:
+                cached[0].characteristics[0].read()
+        except (KeyError, ValueError, TypeError, struct.error, BTLEGattError) as e:
+            log.warning("cached handles of '{}' are invalid ({}), discover services...".format(self.addr, e))
+            self.handle_cache.invalidate(self.addr)
+            return False
+        log.debug("connected '{}' with cached handles of {} services".format(self.addr, len(cached)))
+        return True
+
+    def is_connected(self, probe=False):
+        # the link state is tracked on connect/disconnect, only probe the helper on request
+        if self.peripheral is None or not self.connected: return False
+        if not probe:
+            return True
         try:
             self.peripheral.status()
             return True
         except BTLEException:
+            self.connected = False
             return False
 
     def handleNotification(self, cHandle, data):
-        log.debug("received data: handle={}, data={}".format(cHandle, binascii.b2a_hex(data).decode('utf-8')))
-        for service in self.subscribable_services:
-            if cHandle == service.getHandle():
-                return service.call_listeners(data)
-
-    def listen_for_notifications(self, seconds=None):
-        if seconds is None:
-            while True:
-                if self.peripheral.waitForNotifications(1.0):
-                    continue
-        else:
-            t0 = time.time()
-            while time.time() - t0 < seconds:
-                if self.peripheral.waitForNotifications(1.0):
-                    continue
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("received data: handle={}, data={}".format(cHandle, binascii.b2a_hex(data).decode('utf-8')))
+        if self.capture is not None:
+            self.capture.notification(cHandle, data)
+        characteristic = self._handlers.get(cHandle)
+        if characteristic is not None:
+            if characteristic.metrics is not None:
+                characteristic.metrics.received(len(data))
+            return characteristic.call_listeners(data)
+
+    @_tracks_link
+    def listen_for_notifications(self, seconds=None, until=None, stop=None):
+        # returns True when until() became true, False on timeout or stop
+        if stop is None:
+            stop = self._stop_listening
+        deadline = None if seconds is None else time.monotonic() + seconds
+        try:
+            while not stop.is_set():
+                if until is not None and until():
+                    return True
+                wait = self.MAX_NOTIFICATION_WAIT
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    wait = min(wait, remaining)
+                # returns early with the first notification, so the predicate is checked right after it
+                self.peripheral.waitForNotifications(wait)
+            return False
+        finally:
+            if stop is self._stop_listening:
+                stop.clear()
+
+    def _link_lost(self, error):
+        if not self.connected:
+            return
+        log.warning("lost link to '{}' ({})".format(self.addr, error))
+        self.connected = False
+        if self.metrics is not None:
+            self.metrics.disconnected()
+
+    def stop_listening(self):
+        self._stop_listening.set()
 
     def __str__(self):
         return "Sensirion SmartGadget ({})".format(self.addr)
 
+    @_tracks_link
     def subscribe_temperature(self):
         self.Temperature.subscribe()
 
+    @_tracks_link
     def subscribe_relative_humidity(self):
         self.RelativeHumidity.subscribe()
 
+    @_tracks_link
     def subscribe_battery_level(self):
         self.Battery.subscribe()
 
+    @_tracks_link
     def read_temperature(self):
         return self.Temperature.read()
 
+    @_tracks_link
     def read_relative_humidity(self):
         return self.RelativeHumidity.read()
 
+    @_tracks_link
     def read_battery_level(self):
         return self.Battery.read()
 
-    def download_temperature_and_relative_humidity(self, timeout=15):
+    @_tracks_link
+    def read_all(self, max_age=None):
+        # the current values in one go, values read within max_age (or the ttl) are not read again
+        return Snapshot(self.addr, int(time.time() * 1000.),
+                        self.Temperature.read(max_age),
+                        self.RelativeHumidity.read(max_age),
+                        self.Battery.read(max_age))
+
+    def cache_reads(self, ttl, characteristics=None):
+        # reuse read values for ttl seconds, by default the measurements, the battery level and the logger interval
+        if characteristics is None:
+            characteristics = [self.Temperature, self.RelativeHumidity, self.Battery, self.Logging.LoggerIntervalMs]
+        for characteristic in characteristics:
+            characteristic.ttl = ttl
+
+    def keep_windows(self, capacity, characteristics=None):
+        # rolling aggregates over the last capacity notifications, by default of the measurements
+        if characteristics is None:
+            characteristics = [self.Temperature, self.RelativeHumidity]
+        for characteristic in characteristics:
+            characteristic.keep_window(capacity)
+
+    def window_stats(self):
+        # {name: WindowStats} of the characteristics keeping a window, cheap enough to poll
+        return dict((name, characteristic.window.snapshot())
+                    for name, characteristic in (('temperature', self.Temperature),
+                                                 ('relative_humidity', self.RelativeHumidity),
+                                                 ('battery', self.Battery))
+                    if characteristic.window is not None)
+
+    @_tracks_link
+    def download_temperature_and_relative_humidity(self, timeout=None, columnar=False, retries=None,
+                                                   since=None, until=None, checkpoint=None, stall_timeout=None,
+                                                   archive=None):
+        # timeout is a hard limit, without it the deadline follows the measured throughput
         if not self.is_connected():
             raise Exception("Gadget is not connected!")
+        if since is None and checkpoint is not None:
+            since = checkpoint.get(self.addr)
         self.Temperature.subscribe()
         self.RelativeHumidity.subscribe()
 
-        self.Logging.start_download()
+        self.Logging.start_download(columnar, retries, since, until)
 
-        t0 = time.time()
-        while self.Logging.downloading:
-            self.listen_for_notifications(0.5)
-            if self.Logging.downloading:
-                log.info("downloading {:.0f}%".format(self.Logging.progress()))
-            if (time.time() - t0) > timeout:
-                break
+        watchdog = DownloadWatchdog(self.Logging, timeout, stall_timeout)
+        self.listen_for_notifications(until=watchdog.check)
+        result = watchdog.result({self.Temperature: 'temperature', self.RelativeHumidity: 'relative_humidity'})
 
         self.Temperature.unsubscribe()
         self.RelativeHumidity.unsubscribe()
 
-        return self.Logging.data
+        if archive is not None:
+            archive.append(self.addr, result.frame())
+        if checkpoint is not None and self.Logging.newest_time > 0:
+            checkpoint.update(self.addr, self.Logging.resume_time)
+
+        log.info("download from '{}' {}".format(self.addr, result))
+        return result
 
     def disconnect(self):
         log.info("Disconnect from {}...".format(self.addr))
+        self.connected = False
+        if self.metrics is not None:
+            self.metrics.disconnected()
         if self.peripheral is not None:
-            self.peripheral.disconnect()
+            try:
+                self.peripheral.disconnect()
+            except (BTLEException, OSError) as e:
+                # e.g. the helper was killed by abort()
+                log.debug("disconnect from '{}' failed: {}".format(self.addr, e))
         log.info("Disconnected from {}...".format(self.addr))
+
+    def _create_peripheral(self):
+        if self.peripheral_factory is not Peripheral:
+            return self.peripheral_factory(self.addr, self.addrType, self.iface)
+        # created before connecting, abort() finds the helper of a connect that hangs
+        self._connecting = Peripheral()
+        try:
+            self._connecting.connect(self.addr, self.addrType, self.iface)
+            return self._connecting
+        finally:
+            self._connecting = None
+
+    def abort(self):
+        # ends a blocked bluepy call from another thread, the call fails with BTLEInternalError
+        # the helper process is killed instead of sent a command, the connection is owned by the blocked thread
+        peripheral = self._connecting
+        if peripheral is None:
+            peripheral = self.peripheral
+        helper = getattr(peripheral, '_helper', None)
+        if helper is not None:
+            log.warning("abort connection to '{}'".format(self.addr))
+            helper.kill()
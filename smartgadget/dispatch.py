@@ -0,0 +1,57 @@
+import logging
+import queue
+import threading
+
+log = logging.getLogger(__name__)
+
+BLOCK = 'block'
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+
+
+class NotificationDispatcher(object):
+
+    def __init__(self, maxsize=1024, overflow=DROP_OLDEST):
+        if overflow not in (BLOCK, DROP_NEWEST, DROP_OLDEST):
+            raise ValueError("unknown overflow policy '{}'".format(overflow))
+        self.overflow = overflow
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, name="smartgadget-dispatcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, listeners, value, characteristic):
+        # called on the BLE read loop, must never block it unless asked to
+        item = (tuple(listeners), value, characteristic)
+        if self.overflow == BLOCK:
+            return self._queue.put(item)
+        while True:
+            try:
+                return self._queue.put_nowait(item)
+            except queue.Full:
+                self.dropped += 1
+                if self.overflow == DROP_NEWEST:
+                    log.debug("listener queue full, drop newest value")
+                    return
+                try:
+                    self._queue.get_nowait()
+                    log.debug("listener queue full, drop oldest value")
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            listeners, value, characteristic = item
+            for listener in listeners:
+                try:
+                    listener(value, characteristic)
+                except Exception:
+                    log.exception("listener {} failed".format(listener))
+
+    def close(self, timeout=None):
+        self._queue.put(None)
+        self._thread.join(timeout)
@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+# run() with the timeout of the fleet
+_FLEET_TIMEOUT = object()
+
+
+def _downloading(gadget):
+    # the download watchdog limits a running download, the job timeout stands down
+    return gadget.Logging.downloading
+
+
+class FleetTimeout(Exception):
+    pass
+
+
+class SmartGadgetFleet(object):
+    # seconds a timed out job gets to stop before its connection is aborted, None never aborts
+    ABORT_GRACE = 5.
+
+    def __init__(self, gadgets, max_workers=8, max_per_adapter=4, timeout=120):
+
+        # accept the dict returned by SmartGadgetScanner.scan or any iterable of gadgets
+        if isinstance(gadgets, dict):
+            gadgets = gadgets.values()
+        self.gadgets = dict((gadget.addr, gadget) for gadget in gadgets)
+
+        self.max_workers = max_workers
+        self.max_per_adapter = max_per_adapter
+        self.timeout = timeout
+
+        self._adapter_slots = {}
+        self._adapter_lock = threading.Lock()
+
+    def _adapter_slot(self, gadget):
+        with self._adapter_lock:
+            if gadget.iface not in self._adapter_slots:
+                self._adapter_slots[gadget.iface] = threading.BoundedSemaphore(self.max_per_adapter)
+            return self._adapter_slots[gadget.iface]
+
+    def _on_timeout(self, gadget, timeout, expired, finished, stand_down=None):
+        if stand_down is not None and stand_down(gadget):
+            log.debug("job on '{}' runs past {}s, left to its own limit".format(gadget.addr, timeout))
+            return
+        log.warning("job on '{}' timed out after {}s!".format(gadget.addr, timeout))
+        expired.set()
+        # only the worker thread talks to the peripheral, ask the job to end,
+        # listening and downloads return with what they have so far
+        gadget.stop_listening()
+        if self.ABORT_GRACE is not None and not finished.wait(self.ABORT_GRACE):
+            log.warning("job on '{}' did not stop, abort the connection".format(gadget.addr))
+            gadget.abort()
+
+    def _run(self, gadget, job, timeout, stand_down=None):
+        with self._adapter_slot(gadget):
+            t0 = time.time()
+            expired = threading.Event()
+            finished = threading.Event()
+            watchdog = None
+            # no watchdog without timeout, e.g. for jobs that listen until they are stopped
+            if timeout is not None:
+                watchdog = threading.Timer(timeout, self._on_timeout, (gadget, timeout, expired, finished, stand_down))
+                watchdog.daemon = True
+                watchdog.start()
+            log.info("start job on '{}'...".format(gadget.addr))
+            try:
+                gadget.connect()
+                result = job(gadget)
+            except Exception:
+                if expired.is_set():
+                    raise FleetTimeout("Gadget '{}' did not finish within {}s".format(gadget.addr, timeout))
+                raise
+            finally:
+                finished.set()
+                if watchdog is not None:
+                    watchdog.cancel()
+                gadget.disconnect()
+                log.info("finished job on '{}' after {:.1f}s".format(gadget.addr, time.time() - t0))
+            # a job that returned after the timeout keeps its result, e.g. a partial download
+            return result
+
+    def run(self, job, timeout=_FLEET_TIMEOUT, stand_down=None):
+        # timeout per job in seconds, the timeout of the fleet by default, None for none
+        # stand_down(gadget) is True once the job has a limit of its own, the timeout then no longer applies
+        if timeout is _FLEET_TIMEOUT:
+            timeout = self.timeout
+        results = {}
+        errors = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = dict((addr, executor.submit(self._run, gadget, job, timeout, stand_down))
+                           for addr, gadget in self.gadgets.items())
+
+            for addr, future in futures.items():
+                try:
+                    results[addr] = future.result()
+                except Exception as e:
+                    log.warning("job on '{}' failed: {}".format(addr, e))
+                    errors[addr] = e
+
+        return results, errors
+
+    def download_temperature_and_relative_humidity(self, timeout=None, **kwargs):
+        # the fleet timeout covers connecting and the handshake, the download watchdog ends a download,
+        # a large log takes longer than the fleet timeout; a hard download timeout limits the whole job
+        def job(gadget):
+            return gadget.download_temperature_and_relative_humidity(timeout, **kwargs)
+
+        if timeout is None:
+            return self.run(job, stand_down=_downloading)
+        return self.run(job, timeout + (self.timeout or 0))
@@ -0,0 +1,60 @@
+from bisect import bisect_left, bisect_right
+
+
+class IntervalSet(object):
+
+    def __init__(self):
+        # disjoint, non-touching half open intervals [start, end) sorted by start
+        self._starts = []
+        self._ends = []
+        self._size = 0
+
+    def add(self, start, end):
+        if end <= start:
+            return
+        i = bisect_left(self._ends, start)
+        j = bisect_right(self._starts, end)
+        if i < j:
+            self._size -= sum(e - s for s, e in zip(self._starts[i:j], self._ends[i:j]))
+            start = min(start, self._starts[i])
+            end = max(end, self._ends[j - 1])
+        self._starts[i:j] = [start]
+        self._ends[i:j] = [end]
+        self._size += end - start
+
+    def discard(self, start, end):
+        if end <= start:
+            return
+        i = bisect_right(self._ends, start)
+        j = bisect_left(self._starts, end)
+        if i >= j:
+            return
+        starts, ends = [], []
+        if self._starts[i] < start:
+            starts.append(self._starts[i])
+            ends.append(start)
+        if self._ends[j - 1] > end:
+            starts.append(end)
+            ends.append(self._ends[j - 1])
+        self._size -= sum(e - s for s, e in zip(self._starts[i:j], self._ends[i:j]))
+        self._size += sum(e - s for s, e in zip(starts, ends))
+        self._starts[i:j] = starts
+        self._ends[i:j] = ends
+
+    def clear(self):
+        self._starts = []
+        self._ends = []
+        self._size = 0
+
+    def __contains__(self, value):
+        i = bisect_right(self._starts, value) - 1
+        return i >= 0 and value < self._ends[i]
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return iter(list(zip(self._starts, self._ends)))
+
+    def __repr__(self):
+        return "IntervalSet({})".format(", ".join("[{}, {})".format(s, e) for s, e in self))
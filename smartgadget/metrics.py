@@ -0,0 +1,274 @@
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+log = logging.getLogger(__name__)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30., 60., 120.)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Value(object):
+
+    def __init__(self):
+        self.value = 0.
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1.):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name):
+        return [(name, (), self.value)]
+
+
+class _Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def samples(self, name):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            samples.append((name + '_bucket', (('le', _format_value(bound)),), cumulative))
+        samples.append((name + '_sum', (), self.sum))
+        samples.append((name + '_count', (), cumulative))
+        return samples
+
+
+class Metric(object):
+
+    def __init__(self, name, documentation, kind, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        # resolve the labelled child once and keep it, the hot paths only increment
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError("{} expects the labels {}".format(self.name, self.labelnames))
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = _Histogram(self.buckets) if self.kind == HISTOGRAM else _Value()
+                    self._children[values] = child
+        return child
+
+    def samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            labels = tuple(zip(self.labelnames, values))
+            for name, extra, value in child.samples(self.name):
+                yield name, labels + extra, value
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, name, documentation, kind, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Metric(name, documentation, kind, labelnames, **kwargs)
+            elif metric.kind != kind or metric.labelnames != tuple(labelnames):
+                raise ValueError("metric {} is already registered as {} {}".format(
+                    name, metric.kind, metric.labelnames))
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(name, documentation, COUNTER, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(name, documentation, GAUGE, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(name, documentation, HISTOGRAM, labelnames, buckets=buckets)
+
+    def collect(self):
+        # {sample name: [(labels dict, value), ...]}, the pull API for other exporters
+        with self._lock:
+            metrics = list(self._metrics.values())
+        samples = {}
+        for metric in metrics:
+            for name, labels, value in metric.samples():
+                samples.setdefault(name, []).append((dict(labels), value))
+        return samples
+
+    def render(self):
+        # prometheus text exposition format
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.append("# HELP {} {}".format(metric.name, _escape_help(metric.documentation)))
+            lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                if labels:
+                    name += '{' + ','.join('{}="{}"'.format(k, _escape_label(v)) for k, v in labels) + '}'
+                lines.append("{} {}".format(name, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class ServiceMetrics(object):
+
+    def __init__(self, registry, addr, service):
+        labels = (addr, service)
+        self.notifications = registry.counter('smartgadget_notifications_total',
+                                              "Notifications received",
+                                              ['address', 'service']).labels(*labels)
+        self.bytes = registry.counter('smartgadget_received_bytes_total',
+                                      "Bytes received with notifications",
+                                      ['address', 'service']).labels(*labels)
+        self.samples = registry.counter('smartgadget_download_samples_total',
+                                        "Logger samples received",
+                                        ['address', 'service']).labels(*labels)
+        self.missed = registry.counter('smartgadget_download_missed_samples_total',
+                                       "Logger samples missed in the first download pass",
+                                       ['address', 'service']).labels(*labels)
+
+    def received(self, nbytes):
+        self.notifications.inc()
+        self.bytes.inc(nbytes)
+
+
+class GadgetMetrics(object):
+
+    def __init__(self, registry, addr):
+        self.registry = registry
+        self.addr = addr
+        self.connects = registry.counter('smartgadget_connects_total',
+                                         "Successful connects", ['address']).labels(addr)
+        self.connect_failures = registry.counter('smartgadget_connect_failures_total',
+                                                 "Failed connects", ['address']).labels(addr)
+        self.connect_duration = registry.histogram('smartgadget_connect_duration_seconds',
+                                                   "Duration of a connect including the service discovery",
+                                                   ['address']).labels(addr)
+        self.connected = registry.gauge('smartgadget_connected',
+                                        "1 while the gadget is connected", ['address']).labels(addr)
+        self.downloads = registry.counter('smartgadget_downloads_total',
+                                          "Finished logger downloads", ['address']).labels(addr)
+        self.download_duration = registry.histogram('smartgadget_download_duration_seconds',
+                                                    "Duration of a logger download including recovery",
+                                                    ['address']).labels(addr)
+        self.download_throughput = registry.gauge('smartgadget_download_throughput_samples_per_second',
+                                                  "Samples per second of the last logger download",
+                                                  ['address']).labels(addr)
+        self.download_missing = registry.gauge('smartgadget_download_missing_samples',
+                                               "Samples still missing after the last logger download",
+                                               ['address']).labels(addr)
+
+    def service(self, name):
+        return ServiceMetrics(self.registry, self.addr, name)
+
+    def connect_finished(self, duration):
+        self.connects.inc()
+        self.connect_duration.observe(duration)
+        self.connected.set(1)
+
+    def connect_failed(self):
+        self.connect_failures.inc()
+        self.connected.set(0)
+
+    def disconnected(self):
+        self.connected.set(0)
+
+    def download_finished(self, duration, n_samples, n_missing):
+        self.downloads.inc()
+        self.download_duration.observe(duration)
+        if duration > 0:
+            self.download_throughput.set(n_samples / duration)
+        self.download_missing.set(n_missing)
+
+
+class ScannerMetrics(object):
+
+    def __init__(self, registry):
+        self._advertisements = registry.counter('smartgadget_advertisements_total',
+                                                "Advertisements received from gadgets", ['address'])
+        self._rssi = registry.gauge('smartgadget_rssi_dbm', "Signal strength of the last advertisement",
+                                    ['address'])
+        self.discoveries = registry.counter('smartgadget_discoveries_total',
+                                            "Gadgets discovered by the scanner").labels()
+
+    def advertisement(self, addr, rssi):
+        self._advertisements.labels(addr).inc()
+        if rssi is not None:
+            self._rssi.labels(addr).set(rssi)
+
+
+def start_http_server(registry, port, addr=''):
+    # serve the registry for prometheus to scrape, runs in a daemon thread
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            log.debug(format % args)
+
+    server = HTTPServer((addr, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name="smartgadget-metrics")
+    thread.daemon = True
+    thread.start()
+    return server
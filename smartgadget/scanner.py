@@ -1,9 +1,21 @@
+from collections import deque, namedtuple
+
 from bluepy.btle import DefaultDelegate, Scanner
+from .advertisement import decode_reading
 from .device import SmartGadget
+from .metrics import ScannerMetrics
 import logging
+import time
 
 log = logging.getLogger(__name__)
 
+APPEARED = 'appeared'
+UPDATED = 'updated'
+DISAPPEARED = 'disappeared'
+READING = 'reading'
+
+ScanEvent = namedtuple('ScanEvent', ['kind', 'gadget', 'time', 'reading'])
+
 
 def is_smartgadget(dev):
     for (a, d, v) in dev.getScanData():
@@ -13,30 +25,96 @@ def is_smartgadget(dev):
 
 
 class SmartGadgetScanner(DefaultDelegate, Scanner):
-    def __init__(self, iface=0):
+    def __init__(self, iface=0, metrics=None):
         DefaultDelegate.__init__(self)
         Scanner.__init__(self, iface=iface)
+        # registry handed on to the discovered gadgets
+        self.registry = metrics
+        self.metrics = None if metrics is None else ScannerMetrics(metrics)
         self.gadgets = {}
         self._gadgets = {}
+        self._events = None
+        self._last_seen = {}
         self.withDelegate(self)
 
     def handleDiscovery(self, dev, isNewDev, isNewData):
+        if self._events is not None:
+            return self._handle_stream_discovery(dev, isNewDev, isNewData)
         if isNewDev:
             if is_smartgadget(dev):
                 log.debug("Discovered smart gadget ({0}, {1} db)...".format(dev.addr, dev.rssi))
-                self._gadgets[dev.addr] = SmartGadget(dev)
+                self._gadgets[dev.addr] = SmartGadget(dev, metrics=self.registry)
+                if self.metrics is not None:
+                    self.metrics.discoveries.inc()
+                    self.metrics.advertisement(dev.addr, dev.rssi)
+                self._gadgets[dev.addr].reading = decode_reading(dev)
                 dev.present = True
                 return
             log.debug("Discovered device ({0}, {1} db)...".format(dev.addr, dev.rssi))
         elif isNewData:
             log.debug("Received new data from {0}...".format(dev.addr))
+            if dev.addr in self._gadgets:
+                if self.metrics is not None:
+                    self.metrics.advertisement(dev.addr, dev.rssi)
+                self._gadgets[dev.addr].reading = decode_reading(dev) or self._gadgets[dev.addr].reading
+
+    def _handle_stream_discovery(self, dev, isNewDev, isNewData):
+        gadget = self.gadgets.get(dev.addr)
+        if gadget is None and not is_smartgadget(dev):
+            return
+
+        now = time.monotonic()
+        self._last_seen[dev.addr] = now
+        if self.metrics is not None:
+            self.metrics.advertisement(dev.addr, dev.rssi)
+
+        if gadget is None or not gadget.present:
+            if gadget is None:
+                gadget = SmartGadget(dev, metrics=self.registry)
+                self.gadgets[dev.addr] = gadget
+                if self.metrics is not None:
+                    self.metrics.discoveries.inc()
+            log.debug("Smart gadget appeared ({0}, {1} db)...".format(dev.addr, dev.rssi))
+            gadget.present = True
+            gadget.rssi = dev.rssi
+            self.on_appearance(gadget)
+            self._events.append(ScanEvent(APPEARED, gadget, now, None))
+        elif isNewData or gadget.rssi != dev.rssi:
+            gadget.rssi = dev.rssi
+            self.on_update(gadget)
+            self._events.append(ScanEvent(UPDATED, gadget, now, None))
+
+        if isNewData:
+            reading = decode_reading(dev)
+            if reading is not None:
+                gadget.reading = reading
+                self.on_reading(reading)
+                self._events.append(ScanEvent(READING, gadget, now, reading))
+
+    def _check_disappearance(self, last_seen_timeout):
+        now = time.monotonic()
+        for addr, gadget in self.gadgets.items():
+            # connected gadgets stop advertising
+            if (not gadget.present) or gadget.is_connected():
+                continue
+            if now - self._last_seen.get(addr, now) > last_seen_timeout:
+                log.debug("Smart gadget disappeared ({0})...".format(addr))
+                gadget.present = False
+                self.on_disappearance(gadget)
+                self._events.append(ScanEvent(DISAPPEARED, gadget, now, None))
 
     def on_appearance(self, dev):
         pass
 
+    def on_update(self, dev):
+        pass
+
     def on_disappearance(self, dev):
         pass
 
+    def on_reading(self, reading):
+        pass
+
     def scan(self, timeout=10, passive=False):
         Scanner.scan(self, timeout, passive)
         for addr, dev in self.gadgets.items():
@@ -52,3 +130,31 @@ class SmartGadgetScanner(DefaultDelegate, Scanner):
                 self.gadgets[addr] = dev
         self._gadgets.clear()
         return self.gadgets
+
+    def scan_events(self, last_seen_timeout=30, timeout=None, passive=False, poll_interval=0.05):
+        # scan without interruption and yield appearance, update and disappearance events as they happen
+        self.clear()
+        self._events = deque()
+        self._last_seen = dict((addr, time.monotonic()) for addr, dev in self.gadgets.items() if dev.present)
+        self.start(passive=passive)
+        t0 = time.monotonic()
+        try:
+            while timeout is None or time.monotonic() - t0 < timeout:
+                self.process(poll_interval)
+                self._check_disappearance(last_seen_timeout)
+                while self._events:
+                    yield self._events.popleft()
+        finally:
+            self._events = None
+            self.stop()
+
+    def readings(self, last_seen_timeout=30, timeout=None, passive=False):
+        # live temperature and humidity values broadcast by the gadgets, no connection needed
+        for event in self.scan_events(last_seen_timeout, timeout, passive):
+            if event.kind == READING:
+                yield event.reading
+
+    def watch(self, last_seen_timeout=30, timeout=None, passive=False):
+        # drive the callbacks only
+        for _ in self.scan_events(last_seen_timeout, timeout, passive):
+            pass
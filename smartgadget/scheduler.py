@@ -0,0 +1,169 @@
+import logging
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+PollingRate = namedtuple('PollingRate', ['target', 'achieved', 'polls', 'failures', 'staleness'])
+
+
+def read_values(gadget):
+    # the default poll: connect, read the current values and disconnect
+    gadget.connect()
+    try:
+        return gadget.read_all()
+    finally:
+        gadget.disconnect()
+
+
+class _PollState(object):
+
+    def __init__(self, gadget, interval, priority, now):
+        self.gadget = gadget
+        self.interval = interval
+        self.priority = priority
+        self.added = now
+        self.next_due = now
+        self.last_success = None
+        self.failures = 0
+        self.polls = 0
+        self.n_failures = 0
+        self.running = False
+
+    def staleness(self, now):
+        # age of the data in polling intervals, a gadget that was never polled counts from when it was added
+        return (now - (self.added if self.last_success is None else self.last_success)) / self.interval
+
+
+class PollingScheduler(object):
+
+    def __init__(self, gadgets=(), interval=60., max_connections=2, jitter=0.1,
+                 min_backoff=5., max_backoff=900., poll=read_values):
+
+        self.interval = interval
+        self.max_connections = max_connections
+        self.jitter = jitter
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.poll = poll
+
+        self._states = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stop = False
+        self._running = 0
+        self._random = random.Random()
+
+        if isinstance(gadgets, dict):
+            gadgets = gadgets.values()
+        for gadget in gadgets:
+            self.add(gadget)
+
+    def add(self, gadget, interval=None, priority=1.):
+        with self._lock:
+            self._states[gadget.addr] = _PollState(gadget, self.interval if interval is None else interval,
+                                                   priority, time.monotonic())
+            self._wakeup.notify()
+
+    def remove(self, addr):
+        with self._lock:
+            self._states.pop(addr, None)
+
+    def _spread(self, delay):
+        # avoid that gadgets polled together keep colliding on the adapter
+        return delay * (1. + self.jitter * (2. * self._random.random() - 1.))
+
+    def _next(self, now):
+        # the due gadget with the stalest data weighted by its priority
+        due = [s for s in self._states.values() if not s.running and s.next_due <= now]
+        if not due:
+            return None
+        return max(due, key=lambda s: s.staleness(now) * s.priority)
+
+    def _wait_time(self, now):
+        pending = [s.next_due for s in self._states.values() if not s.running]
+        if not pending:
+            return None
+        return max(0., min(pending) - now)
+
+    def _poll(self, state):
+        gadget = state.gadget
+        try:
+            result = self.poll(gadget)
+        except Exception as e:
+            with self._lock:
+                state.failures += 1
+                state.n_failures += 1
+                delay = min(self.max_backoff, self.min_backoff * 2 ** (state.failures - 1))
+                state.next_due = time.monotonic() + self._spread(delay)
+            log.warning("poll of '{}' failed ({}), retry in {:.1f}s".format(gadget.addr, e, delay))
+            self.on_error(gadget, e)
+        else:
+            with self._lock:
+                now = time.monotonic()
+                state.failures = 0
+                state.polls += 1
+                state.last_success = now
+                state.next_due = now + self._spread(state.interval)
+            self.on_result(gadget, result)
+        finally:
+            with self._lock:
+                state.running = False
+                self._running -= 1
+                self._wakeup.notify()
+
+    def run(self, duration=None):
+        # poll until stop() is called or the duration elapsed
+        deadline = None if duration is None else time.monotonic() + duration
+        with ThreadPoolExecutor(max_workers=self.max_connections) as executor:
+            with self._lock:
+                self._stop = False
+                while not self._stop:
+                    now = time.monotonic()
+                    if deadline is not None and now >= deadline:
+                        break
+                    state = self._next(now) if self._running < self.max_connections else None
+                    if state is not None:
+                        state.running = True
+                        self._running += 1
+                        executor.submit(self._poll, state)
+                        continue
+                    timeout = None if self._running >= self.max_connections else self._wait_time(now)
+                    if deadline is not None:
+                        timeout = deadline - now if timeout is None else min(timeout, deadline - now)
+                    self._wakeup.wait(timeout)
+                self._stop = True
+
+    def stop(self):
+        with self._lock:
+            self._stop = True
+            self._wakeup.notify()
+
+    def rates(self):
+        # achieved versus target polls per second of every gadget
+        now = time.monotonic()
+        with self._lock:
+            return dict((addr, PollingRate(1. / s.interval,
+                                           s.polls / (now - s.added) if now > s.added else 0.,
+                                           s.polls, s.n_failures, s.staleness(now)))
+                        for addr, s in self._states.items())
+
+    def report(self):
+        rates = self.rates()
+        target = sum(r.target for r in rates.values())
+        achieved = sum(r.achieved for r in rates.values())
+        log.info("polling {} gadgets at {:.3f}/s of {:.3f}/s".format(len(rates), achieved, target))
+        for addr, r in sorted(rates.items()):
+            if r.achieved < 0.8 * r.target:
+                log.info("'{}' polled at {:.3f}/s of {:.3f}/s, {} failures".format(
+                    addr, r.achieved, r.target, r.failures))
+        return rates
+
+    def on_result(self, gadget, result):
+        pass
+
+    def on_error(self, gadget, error):
+        pass
@@ -1,33 +1,50 @@
 import datetime
 import logging
-import struct
 import time
 
-from bluepy.btle import Characteristic as _Characteristic, Descriptor, UUID
+from bluepy.btle import Characteristic as _Characteristic, Service as _Service, Descriptor, UUID
+
+from .codec import codec_for, SEQUENCE_NUMBER, FLOAT32, UINT8, UINT32, UINT64
+from .data import ColumnarData
+from .intervals import IntervalSet
+from .window import RollingWindow
 
 log = logging.getLogger(__name__)
 
 
 class Characteristic(_Characteristic):
+    # set by connect_to, the service this characteristic belongs to resolves it on first use
+    peripheral = None
+    _service = None
 
     def __init__(self,
                  description_handle_offset=None,
                  unit=None,
-                 byte_format=None, nbytes=1):
+                 byte_format=None, nbytes=1, codec=None):
 
         self.description_handle_offset = description_handle_offset
 
         self.byte_format = byte_format
         self.nbytes = nbytes
+        # decodes and encodes the values, a shared precompiled codec of the byte format by default
+        self.codec = codec_for(byte_format) if codec is None else codec
         self._unit = unit
-
-    def connect_to(self, chr: _Characteristic):
+        # records the raw values read and written, see smartgadget.capture
+        self.capture = None
+        # seconds a read value is reused before the gadget is asked again, None reads every time
+        self.ttl = None
+        self._read_time = None
+        self._read_value = None
+        self._description_cache = None
+
+    def connect_to(self, chr: _Characteristic, description=None):
         _Characteristic.__init__(self,
                                  chr.peripheral,
                                  chr.uuid,
                                  chr.handle,
                                  chr.properties,
                                  chr.valHandle)
+        self._read_time = None
 
         if self.description_handle_offset is None:
             self._description_read = self.uuid.getCommonName
@@ -37,7 +54,19 @@ class Characteristic(_Characteristic):
                                                 self.valHandle + self.description_handle_offset)
             self._description_read = self._description_desc.read
 
-        self._description_cache = self.description_read()
+        # read on first access
+        self._description_cache = description
+
+    def _resolve(self):
+        if self.peripheral is None and self._service is not None:
+            self._service.resolve()
+
+    def getHandle(self):
+        self._resolve()
+        return self.valHandle
+
+    def cache_entry(self):
+        return [str(self.uuid), self.handle, self.properties, self.valHandle, self._description_cache]
 
     @property
     def unit(self):
@@ -46,28 +75,31 @@ class Characteristic(_Characteristic):
         return self.description.split(' ')[-1]
 
     def unpack_data(self, bytes):
-
-        if self.byte_format:
-            bytes = struct.unpack(self.byte_format, bytes)
-            assert len(bytes) == self.nbytes
-            if self.nbytes == 1:
-                bytes = bytes[0]
-
-        return bytes
+        return self.codec.decode(bytes)
 
     def pack_data(self, data):
-
-        if self.byte_format:
-            data = struct.pack(self.byte_format, data)
-
-        return data
-
-    def read(self):
+        return self.codec.encode(data)
+
+    def read(self, max_age=None):
+        # max_age overrides the ttl of this read, 0 always asks the gadget
+        if max_age is None:
+            max_age = self.ttl
+        if max_age is not None and self._read_time is not None and time.monotonic() - self._read_time <= max_age:
+            return self._read_value
+        self._resolve()
         data = _Characteristic.read(self)
-        return self.unpack_data(data)
+        if self.capture is not None:
+            self.capture.read(self.valHandle, data)
+        self._read_value = self.unpack_data(data)
+        self._read_time = time.monotonic()
+        return self._read_value
 
     def write(self, value, with_response=False):
+        self._resolve()
+        self._read_time = None
         data = self.pack_data(value)
+        if self.capture is not None:
+            self.capture.write(self.valHandle, data)
         return _Characteristic.write(self, data, with_response)
 
     def description_read(self):
@@ -78,6 +110,9 @@ class Characteristic(_Characteristic):
 
     @property
     def description(self):
+        if self._description_cache is None:
+            self._resolve()
+            self._description_cache = self.description_read()
         return self._description_cache
 
 
@@ -89,18 +124,27 @@ class SubscribableCharacteristic(Characteristic):
         Characteristic.__init__(self, *args, **kwargs)
         self.subscription_handle_offset = subscription_handle_offset
         self.listeners = []
-
-    def connect_to(self, chr: _Characteristic):
-        Characteristic.connect_to(self, chr)
+        self.dispatcher = None
+        self.metrics = None
+        # the recent notified values with their aggregates, see keep_window
+        self.window = None
+        self._subscribed = None
+
+    def connect_to(self, chr: _Characteristic, description=None):
+        Characteristic.connect_to(self, chr, description)
         self.subscription = Descriptor(self.peripheral, self.uuid, self.valHandle + self.subscription_handle_offset)
-        self._subscribed = self.subscription.read() != b'\x00\x00'
+        # the subscription state is read from the gadget on first use
+        self._subscribed = None
 
     def subscribe(self):
-        self.subscription.write(b'\x01\x00')
+        self._resolve()
+        # write through the peripheral, Descriptor.write of bluepy 1.3.0 fails after writing
+        self.peripheral.writeCharacteristic(self.subscription.handle, b'\x01\x00')
         self._subscribed = True
 
     def unsubscribe(self):
-        self.subscription.write(b'\x00\x00')
+        self._resolve()
+        self.peripheral.writeCharacteristic(self.subscription.handle, b'\x00\x00')
         self._subscribed = False
 
     def register_listener(self, callback):
@@ -109,12 +153,30 @@ class SubscribableCharacteristic(Characteristic):
     def unregister_listener(self, callback):
         self.listeners.remove(callback)
 
+    def keep_window(self, capacity):
+        # keep the last capacity notified values, None drops the window
+        self.window = None if capacity is None else RollingWindow(capacity)
+        return self.window
+
     def call_listeners(self, data):
+        if not self.listeners and self.window is None:
+            return
+        # decode once for all listeners
+        value = self.unpack_data(data)
+        if self.window is not None:
+            self.window.append(value)
+        if not self.listeners:
+            return
+        if self.dispatcher is not None:
+            return self.dispatcher.submit(self.listeners, value, self)
         for listener in self.listeners:
-            listener(self.unpack_data(data), self)
+            listener(value, self)
 
     @property
     def subscribed(self):
+        if self._subscribed is None:
+            self._resolve()
+            self._subscribed = self.subscription.read() != b'\x00\x00'
         return self._subscribed
 
 
@@ -124,12 +186,52 @@ class Service(object):
         self.service_uuid = UUID(uuid)
         self.service = None
         self.characteristics = characteristics
+        for ch in characteristics:
+            ch._service = self
+        self._connection = None
+        self._on_resolved = None
 
     def connect(self, connection):
         self.service = connection.getServiceByUUID(self.service_uuid)
         for ch, _ch in zip(self.characteristics, self.service.getCharacteristics()):
             ch.connect_to(_ch)
 
+    def attach(self, connection, on_resolved=None):
+        # discover the service on the first use of one of its characteristics
+        self._connection = connection
+        self._on_resolved = on_resolved
+        self.service = None
+        for ch in self.characteristics:
+            ch.peripheral = None
+
+    def resolve(self):
+        if self.service is not None or self._connection is None:
+            return
+        log.debug("discover service {}...".format(self.service_uuid))
+        self.connect(self._connection)
+        if self._on_resolved is not None:
+            self._on_resolved(self)
+
+    def connect_cached(self, connection, entry):
+        # use handles and descriptions of an earlier discovery instead of asking the gadget again
+        if len(entry['characteristics']) != len(self.characteristics):
+            raise ValueError("cached handles do not match the characteristics of {}".format(self.service_uuid))
+        self.service = _Service(connection, self.service_uuid, entry['start'], entry['end'])
+        for ch, (uuid, handle, properties, val_handle, description) in zip(self.characteristics,
+                                                                           entry['characteristics']):
+            ch.connect_to(_Characteristic(connection, uuid, handle, properties, val_handle), description)
+
+    def service_entry(self):
+        return {'start': self.service.hndStart,
+                'end': self.service.hndEnd,
+                'characteristics': [ch.cache_entry() for ch in self.characteristics]}
+
+
+def to_timestamp_ms(t):
+    if isinstance(t, datetime.datetime):
+        return int(t.timestamp() * 1000.)
+    return int(t)
+
 
 def add_int_to_part_of_uuid(uuid, value, part=0):
     uuid = UUID(uuid)
@@ -143,6 +245,7 @@ class Uint8Service(Service, SubscribableCharacteristic):
 
     def __init__(self, uuid, *args, **kwargs):
         Service.__init__(self, uuid, [self])
+        kwargs.setdefault('codec', UINT8)
         SubscribableCharacteristic.__init__(self,
                                             byte_format='<B',
                                             nbytes=1, *args, **kwargs)
@@ -152,6 +255,7 @@ class Float32Service(Service, SubscribableCharacteristic):
 
     def __init__(self, uuid, *args, **kwargs):
         Service.__init__(self, uuid, [self])
+        kwargs.setdefault('codec', FLOAT32)
         SubscribableCharacteristic.__init__(self,
                                             description_handle_offset=1,
                                             subscription_handle_offset=2,
@@ -160,8 +264,11 @@ class Float32Service(Service, SubscribableCharacteristic):
 
 
 class LoggingService(Service):
+    # the longest the download watchdog waits for the first packet of a pass
     DOWNLOAD_TIMEOUT = 10
     SEQUENCE_NUMBER_SIZE = 4
+    RECOVERY_RETRIES = 3
+    RECOVERY_MERGE_DISTANCE = 64
 
     def __init__(self,
                  uuid,
@@ -171,15 +278,15 @@ class LoggingService(Service):
         self.subscribables = subscribables
 
         self.SyncTimeMs = Characteristic(description_handle_offset=1,
-                                         byte_format='<Q', *args, **kwargs)
+                                         byte_format='<Q', codec=UINT64, *args, **kwargs)
         self.OldestTimestampMs = Characteristic(description_handle_offset=1,
-                                                byte_format='<Q', *args, **kwargs)
+                                                byte_format='<Q', codec=UINT64, *args, **kwargs)
         self.NewestTimestampMs = Characteristic(description_handle_offset=1,
-                                                byte_format='<Q', *args, **kwargs)
+                                                byte_format='<Q', codec=UINT64, *args, **kwargs)
         self.StartLoggerDownload = Characteristic(description_handle_offset=1,
-                                                  byte_format='<B', *args, **kwargs)
+                                                  byte_format='<B', codec=UINT8, *args, **kwargs)
         self.LoggerIntervalMs = Characteristic(description_handle_offset=1,
-                                               byte_format='<I', *args, **kwargs)
+                                               byte_format='<I', codec=UINT32, *args, **kwargs)
 
         Service.__init__(self, uuid,
                          [
@@ -197,6 +304,12 @@ class LoggingService(Service):
         self.n_samples_missed = {}
 
         self._old_delegate = None
+        self._handlers = {}
+        self.capture = None
+        self.metrics = None
+        self.time_start = 0
+        # time base of the download timeout, replaced by the capture time when replaying
+        self.clock = time.monotonic
 
     def _reset_download(self):
         self.missed_sequences = {}
@@ -204,21 +317,34 @@ class LoggingService(Service):
         self.newest_time = 0
         self.interval = 0
         self.n_samples_to_download = 0
+        # samples of the whole download and samples received so far, kept after the download ended
+        self.n_samples_total = 0
+        self.n_received = 0
+        self.columnar = False
+        self.retries = 0
+        self._recovering = False
+        # windows left in the current recovery round, newest first
+        self._round = []
+        self._offset = 0
+        self._pass_samples = 0
 
     @property
     def description(self):
         return "Logging Service"
 
-    def start_download(self):
+    def start_download(self, columnar=False, retries=None, since=None, until=None):
 
         log.info("initiate download....")
         self._reset_download()
+        self.columnar = columnar
+        self.retries = self.RECOVERY_RETRIES if retries is None else retries
 
         interval = self.LoggerIntervalMs.read()
         log.info("read logging interval: {0} ms".format(interval))
 
-        self.OldestTimestampMs.write(0)
-        log.info("wrote oldest timestamp: {0} ms".format(0))
+        oldest_time = 0 if since is None else to_timestamp_ms(since)
+        self.OldestTimestampMs.write(oldest_time)
+        log.info("wrote oldest timestamp: {0} ms".format(oldest_time))
 
         time_ms = int(time.time() * 1000.)
         self.SyncTimeMs.write(time_ms)
@@ -226,116 +352,239 @@ class LoggingService(Service):
 
         time.sleep(0.5)
 
+        if until is not None:
+            newest_time = to_timestamp_ms(until)
+            self.NewestTimestampMs.write(newest_time)
+            log.info("wrote newest timestamp: {0} ms".format(newest_time))
+
         newest_time = self.NewestTimestampMs.read()
         log.info("read newest timestamp: {0} ms".format(newest_time))
 
         oldest_time = self.OldestTimestampMs.read()
         log.info("read oldest timestamp: {0} ms".format(oldest_time))
 
-        n_samples_to_download = int((newest_time - oldest_time) / interval)
-        logging_time = datetime.timedelta(milliseconds=newest_time - oldest_time)
+        n_samples_to_download = max(0, int((newest_time - oldest_time) / interval))
+        logging_time = datetime.timedelta(milliseconds=max(0, newest_time - oldest_time))
         log.info("devices has {} samples ({}) in memory".format(n_samples_to_download, logging_time))
 
-        log.info("start download....")
         self.oldest_time = oldest_time
         self.newest_time = newest_time
         self.interval = interval
-
-        # set the delegate temporary to the logging service
-        self.time_start_download = time.time()
-        self._old_delegate = self.service.peripheral.delegate
-        self.service.peripheral.withDelegate(self)
+        self.n_samples_total = n_samples_to_download
 
         # create counter and data storage for all subscribed services
         subscribed_services = [src for src in self.subscribables if src.subscribed]
-        self.n_samples_to_download = n_samples_to_download
-        self.n_samples_downloaded = dict(zip(subscribed_services, [n_samples_to_download] * len(subscribed_services)))
         self.n_samples_missed = dict(zip(subscribed_services, [0] * len(subscribed_services)))
         self.data = {}
         for srv in subscribed_services:
-            self.data[srv] = list()
-            self.missed_sequences[srv] = list()
+            if columnar:
+                # preallocate the whole download, samples are written to their sequence position
+                self.data[srv] = ColumnarData(n_samples_to_download, newest_time, interval, srv.byte_format)
+            else:
+                self.data[srv] = list()
+            self.missed_sequences[srv] = IntervalSet()
 
+        if n_samples_to_download == 0:
+            log.info("nothing to download!")
+            return
+
+        log.info("start download....")
+        self.time_start = self.clock()
+
+        # set the delegate temporary to the logging service
+        self._handlers = dict((srv.getHandle(), srv) for srv in self.subscribables)
+        self._old_delegate = self.service.peripheral.delegate
+        self.service.peripheral.withDelegate(self)
+
+        self.n_samples_to_download = n_samples_to_download
+        self._start_pass(0, n_samples_to_download)
+
+    def _start_pass(self, offset, n_samples):
+        # sequence numbers of a pass start at 1 for the newest sample of the requested window,
+        # offset maps them to the sample numbers of the whole download
+        self._offset = offset
+        self._pass_samples = n_samples
+        self.n_samples_downloaded = dict((srv, 0) for srv in self.data)
+        self.time_start_download = self.clock()
         self.StartLoggerDownload.write(1)
 
     def _sample_number_to_time(self, sample):
         return self.newest_time - sample * self.interval
 
+    @property
+    def resume_time(self):
+        # all samples newer than this timestamp are downloaded, use it as since of the next download
+        missing = [end for missed in self.missed_sequences.values() for _, end in missed]
+        if missing:
+            return self._sample_number_to_time(max(missing))
+        return self.newest_time
+
     def handleNotification(self, cHandle, data):
 
-        log.debug("arrived a download notification: {}".format(cHandle))
-        log.debug("data length: {}".format(len(data)))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("arrived a download notification: {}".format(cHandle))
+            log.debug("data length: {}".format(len(data)))
 
-        for service in self.subscribables:
-            if cHandle == service.getHandle():
-                return self._process_download_data(service, data)
+        if self.capture is not None:
+            self.capture.notification(cHandle, data)
+        service = self._handlers.get(cHandle)
+        if service is not None:
+            if service.metrics is not None:
+                service.metrics.received(len(data))
+            return self._process_download_data(service, data)
 
     def _process_download_data(self, srv: Characteristic, data):
 
         if len(data) <= self.SEQUENCE_NUMBER_SIZE:
-            if (time.time() - self.time_start_download) >= self.DOWNLOAD_TIMEOUT:
-                self.on_download_failed()
+            # live values keep arriving during a download, only the watchdog ends a stalled pass
             return srv.call_listeners(data)
 
-        seq_number = struct.unpack('<I', data[:self.SEQUENCE_NUMBER_SIZE])[0]
-        log.debug("sequence {} arrived!".format(seq_number))
+        seq_number = SEQUENCE_NUMBER.struct.unpack_from(data)[0]
+        debug = log.isEnabledFor(logging.DEBUG)
+        if debug:
+            log.debug("sequence {} arrived!".format(seq_number))
 
-        log.debug("description: {}".format(srv.description))
         next_seq_number = self.n_samples_downloaded[srv] + 1
 
-        size = struct.calcsize(srv.byte_format)
-        seq_bytes = len(data) - self.SEQUENCE_NUMBER_SIZE
-        seq_length = seq_bytes // size
-        assert seq_bytes % size == 0
+        # a truncated value at the end of the packet is dropped
+        seq_length = srv.codec.count(len(data) - self.SEQUENCE_NUMBER_SIZE)
 
-        if seq_number > next_seq_number:
+        # during recovery only the already known gaps are of interest
+        if seq_number > next_seq_number and not self._recovering:
             self.n_samples_missed[srv] += (seq_number - next_seq_number)
-            self.missed_sequences[srv].extend(range(next_seq_number, seq_number, seq_length))
-            log.debug("Download missed sequence {}! Continue with sequence {}".format(next_seq_number,
-                                                                                      seq_number))
-        if seq_number in self.missed_sequences[srv]:
-            self.missed_sequences[srv].remove(seq_number)
-
-        stream = list((seq_number + i - 1,
-                       self._sample_number_to_time(seq_number + i - 1),
-                       d[0]) for i, d in enumerate(struct.iter_unpack(srv.byte_format,
-                                                                      data[self.SEQUENCE_NUMBER_SIZE:])))
-        assert len(stream) == seq_length
+            self.missed_sequences[srv].add(next_seq_number - 1, seq_number - 1)
+            if srv.metrics is not None:
+                srv.metrics.missed.inc(seq_number - next_seq_number)
+            if debug:
+                log.debug("Download missed sequence {}! Continue with sequence {}".format(next_seq_number,
+                                                                                          seq_number))
+
+        sample = self._offset + seq_number - 1
+        if self.columnar:
+            self.data[srv].put(sample, memoryview(data)[self.SEQUENCE_NUMBER_SIZE:])
+        else:
+            self._store_download_data(srv, sample, seq_length, data)
+        self.missed_sequences[srv].discard(sample, sample + seq_length)
+        self.n_received += seq_length
+        if srv.metrics is not None:
+            srv.metrics.samples.inc(seq_length)
+
+        self.n_samples_downloaded[srv] = max(self.n_samples_downloaded[srv], seq_number + seq_length - 1)
+
+        if all(self._pass_samples - n <= 0 for n in self.n_samples_downloaded.values()):
+            self.on_download_finished()
+
+    def _store_download_data(self, srv: Characteristic, sample, seq_length, data):
+        t = self._sample_number_to_time(sample)
+        interval = self.interval
+        values = srv.codec.decode_many(data, self.SEQUENCE_NUMBER_SIZE, seq_length)
+        stream = [(sample + i, t - i * interval, value) for i, value in enumerate(values)]
+
+        if self._recovering:
+            missed = self.missed_sequences[srv]
+            stream = [s for s in stream if s[0] in missed]
 
         # store data
         self.data[srv].extend(stream)
 
-        log.debug("sequence: {}".format(stream))
-
-        self.n_samples_downloaded[srv] = seq_number + seq_length - 1
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("sequence: {}".format(stream))
+
+    def _recovery_windows(self):
+        gaps = sorted(gap for missed in self.missed_sequences.values() for gap in missed)
+        windows = []
+        for start, end in gaps:
+            # take neighbouring gaps along when it is cheaper to download the samples in between again
+            if windows and start - windows[-1][1] <= self.RECOVERY_MERGE_DISTANCE:
+                windows[-1][1] = max(windows[-1][1], end)
+            else:
+                windows.append([start, end])
+        return windows
+
+    def _start_recovery(self, start, end):
+        newest_time = self._sample_number_to_time(start)
+        oldest_time = self._sample_number_to_time(end)
+        log.info("re-download samples {} to {} ({} ms to {} ms)...".format(start, end - 1, newest_time, oldest_time))
+
+        self.OldestTimestampMs.write(oldest_time)
+        self.NewestTimestampMs.write(newest_time)
+        newest_time = self.NewestTimestampMs.read()
+        oldest_time = self.OldestTimestampMs.read()
 
-        if all(self.n_samples_to_download - n == 0 for n in self.n_samples_downloaded.values()):
-            self.on_download_finished()
+        self._recovering = True
+        self._start_pass(int(round((self.newest_time - newest_time) / self.interval)),
+                         int((newest_time - oldest_time) / self.interval))
+
+    def _record_trailing_gaps(self):
+        if not self._recovering:
+            # samples at the end of the main pass that never arrived
+            for srv, n in self.n_samples_downloaded.items():
+                if n < self._pass_samples:
+                    self.n_samples_missed[srv] += self._pass_samples - n
+                    self.missed_sequences[srv].add(n, self._pass_samples)
+                    if srv.metrics is not None:
+                        srv.metrics.missed.inc(self._pass_samples - n)
+
+    def _end_pass(self):
+        self.StartLoggerDownload.write(0)
+        self._record_trailing_gaps()
+
+        # a retry is a round over all gaps, one pass per window of gaps
+        if not self._round and self.retries > 0:
+            self._round = self._recovery_windows()
+            if self._round:
+                self.retries -= 1
+                log.info("recovery round over {} windows, {} retries left".format(len(self._round), self.retries))
+        if self._round:
+            self._start_recovery(*self._round.pop(0))
+        else:
+            self._stop_download()
 
     def _stop_download(self):
-        self.StartLoggerDownload.write(0)
         self.service.peripheral.withDelegate(self._old_delegate)
         log.info("Download finished!")
 
         log.info("expected samples: {}".format(self.n_samples_to_download))
+        if self.metrics is not None:
+            n_missing = sum(len(missed) for missed in self.missed_sequences.values())
+            self.metrics.download_finished(self.clock() - self.time_start,
+                                           len(self.data) * self.n_samples_to_download - n_missing, n_missing)
         for srv, d in self.data.items():
-            log.info("{}: downloaded {}, missed {}".format(srv.description, len(d), self.n_samples_missed[srv]))
-            log.info("missed sequences ({}) {}".format(len(self.missed_sequences[srv]) * 4,
-                                                       self.missed_sequences[srv]))
+            if self.columnar:
+                n_downloaded = d.n_received
+            else:
+                n_downloaded = len(d)
+                if self._recovering:
+                    d.sort()
+            if log.isEnabledFor(logging.INFO):
+                # the description only when it was read anyway, reading it costs a request on the radio
+                name = srv.uuid if srv._description_cache is None else srv._description_cache
+                log.info("{}: downloaded {}, missed {}".format(name, n_downloaded, self.n_samples_missed[srv]))
+                log.info("missing samples ({}) {}".format(len(self.missed_sequences[srv]),
+                                                          self.missed_sequences[srv]))
         self.n_samples_to_download = 0
+        self._recovering = False
+
+    def stop_download(self):
+        # give up the download with whatever was received
+        if self.downloading:
+            self.StartLoggerDownload.write(0)
+            # the checkpoint must not skip what was not received yet
+            self._record_trailing_gaps()
+            self._stop_download()
 
     def on_download_failed(self):
-        self._stop_download()
+        self._end_pass()
 
     def on_download_finished(self):
-        self._stop_download()
+        self._end_pass()
 
     @property
     def downloading(self):
         return self.n_samples_to_download > 0
 
     def progress(self):
-        if self.n_samples_to_download > 0:
-            return float(min(self.n_samples_downloaded.values()) * 100.) / self.n_samples_to_download
+        if self.n_samples_to_download > 0 and self._pass_samples > 0:
+            return float(min(self.n_samples_downloaded.values()) * 100.) / self._pass_samples
         else:
             return 0
@@ -0,0 +1,244 @@
+import math
+import random
+import struct
+import time
+from array import array
+from collections import deque
+
+from bluepy.btle import Characteristic, Service, UUID, BTLEGattError, BTLEDisconnectError
+
+BATTERY_SERVICE = UUID("180F")
+TEMPERATURE_SERVICE = UUID("00002234-b38d-4985-720e-0f993a68ee41")
+HUMIDITY_SERVICE = UUID("00001234-b38d-4985-720e-0f993a68ee41")
+LOGGING_SERVICE = UUID("0000f234-b38d-4985-720e-0f993a68ee41")
+
+# value handles of the simulated GATT table
+BATTERY = 12
+TEMPERATURE = 34
+HUMIDITY = 39
+SYNC_TIME = 50
+OLDEST_TIMESTAMP = 53
+NEWEST_TIMESTAMP = 56
+START_LOGGER_DOWNLOAD = 59
+LOGGER_INTERVAL = 62
+
+# service -> (start handle, end handle, [(characteristic uuid, declaration handle, properties, value handle)])
+GATT = {
+    BATTERY_SERVICE: (10, 13, [(0x2a19, 11, 0x12, BATTERY)]),
+    TEMPERATURE_SERVICE: (32, 36, [("00002235-b38d-4985-720e-0f993a68ee41", 33, 0x12, TEMPERATURE)]),
+    HUMIDITY_SERVICE: (37, 41, [("00001235-b38d-4985-720e-0f993a68ee41", 38, 0x12, HUMIDITY)]),
+    LOGGING_SERVICE: (48, 63, [("0000f235-b38d-4985-720e-0f993a68ee41", 49, 0x08, SYNC_TIME),
+                               ("0000f236-b38d-4985-720e-0f993a68ee41", 52, 0x0a, OLDEST_TIMESTAMP),
+                               ("0000f237-b38d-4985-720e-0f993a68ee41", 55, 0x0a, NEWEST_TIMESTAMP),
+                               ("0000f238-b38d-4985-720e-0f993a68ee41", 58, 0x0a, START_LOGGER_DOWNLOAD),
+                               ("0000f239-b38d-4985-720e-0f993a68ee41", 61, 0x0a, LOGGER_INTERVAL)]),
+}
+
+DESCRIPTIONS = {
+    TEMPERATURE + 1: b"Temperature \xc2\xb0C",
+    HUMIDITY + 1: b"Relative Humidity %",
+    SYNC_TIME + 1: b"Sync Time ms",
+    OLDEST_TIMESTAMP + 1: b"Oldest Timestamp ms",
+    NEWEST_TIMESTAMP + 1: b"Newest Timestamp ms",
+    START_LOGGER_DOWNLOAD + 1: b"Start Logger Download",
+    LOGGER_INTERVAL + 1: b"Logger Interval ms",
+}
+
+# client characteristic configuration descriptors
+CCCD = {BATTERY + 1: BATTERY, TEMPERATURE + 2: TEMPERATURE, HUMIDITY + 2: HUMIDITY}
+
+SAMPLES_PER_PACKET = 4
+
+
+class SimulatedPeripheral(object):
+
+    def __init__(self, deviceAddr=None, addrType=None, iface=None,
+                 n_samples=1000, interval=1000, packet_rate=None, loss_rate=0.,
+                 live_interval=1., live_during_download=False, seed=0):
+        self.addr = deviceAddr
+        self.addrType = addrType
+        self.iface = iface
+        self.delegate = None
+        self.connected = True
+
+        self.interval = interval
+        self.packet_rate = packet_rate
+        self.loss_rate = loss_rate
+        self.live_interval = live_interval
+        # a real gadget keeps sending live values while it uploads its log
+        self.live_during_download = live_during_download
+        self.random = random.Random(seed)
+
+        # number of ATT requests served, discovery included
+        self.requests = 0
+
+        self.temperature = array('f', (20. + 5. * math.sin(i / 600.) for i in range(n_samples)))
+        self.humidity = array('f', (50. + 10. * math.cos(i / 900.) for i in range(n_samples)))
+        self.battery = 87
+
+        self.newest_time = int(time.time() * 1000.)
+        self._requested_oldest = 0
+        self._requested_newest = None
+        self._downloading = 0
+
+        self._subscribed = set()
+        self._packets = deque()
+        self._next_packet = time.monotonic()
+        self._next_live = time.monotonic() + live_interval
+
+    @classmethod
+    def factory(cls, **config):
+        # used as SmartGadget.peripheral_factory
+        return lambda deviceAddr, addrType=None, iface=None: cls(deviceAddr, addrType, iface, **config)
+
+    @property
+    def n_samples(self):
+        return len(self.temperature)
+
+    def withDelegate(self, delegate):
+        self.delegate = delegate
+        return self
+
+    def status(self):
+        self._check()
+        return {'rsp': ['stat'], 'state': ['conn']}
+
+    def disconnect(self):
+        self.connected = False
+
+    def _check(self):
+        if not self.connected:
+            raise BTLEDisconnectError("Device disconnected", {'estat': [0], 'emsg': ['disconnected']})
+
+    def _att_error(self, handle):
+        raise BTLEGattError("Bluetooth command failed", {'estat': [1], 'emsg': ['invalid handle {}'.format(handle)]})
+
+    def getServiceByUUID(self, uuid):
+        self._check()
+        self.requests += 1
+        uuid = UUID(uuid)
+        if uuid not in GATT:
+            raise BTLEGattError("Service {} not found".format(uuid))
+        start, end, _ = GATT[uuid]
+        return Service(self, uuid, start, end)
+
+    def getCharacteristics(self, startHnd=1, endHnd=0xFFFF, uuid=None):
+        self._check()
+        self.requests += 1
+        return [Characteristic(self, *c) for start, end, chars in GATT.values() for c in chars
+                if startHnd <= c[1] <= endHnd]
+
+    def _window(self):
+        # sample numbers [first, last) inside the requested timestamps, sample 0 is the newest
+        last = min(self.n_samples, (self.newest_time - self._requested_oldest) // self.interval)
+        first = 0
+        if self._requested_newest is not None:
+            first = max(0, -((self._requested_newest - self.newest_time) // self.interval))
+        return first, max(first, last)
+
+    def readCharacteristic(self, handle):
+        self._check()
+        self.requests += 1
+        if handle == TEMPERATURE:
+            return struct.pack('<f', self.temperature[0])
+        if handle == HUMIDITY:
+            return struct.pack('<f', self.humidity[0])
+        if handle == BATTERY:
+            return struct.pack('<B', self.battery)
+        if handle == SYNC_TIME:
+            return struct.pack('<Q', self.newest_time)
+        if handle == OLDEST_TIMESTAMP:
+            return struct.pack('<Q', self.newest_time - self._window()[1] * self.interval)
+        if handle == NEWEST_TIMESTAMP:
+            return struct.pack('<Q', self.newest_time - self._window()[0] * self.interval)
+        if handle == START_LOGGER_DOWNLOAD:
+            return struct.pack('<B', self._downloading)
+        if handle == LOGGER_INTERVAL:
+            return struct.pack('<I', self.interval)
+        if handle in DESCRIPTIONS:
+            return DESCRIPTIONS[handle]
+        if handle in CCCD:
+            return b'\x01\x00' if CCCD[handle] in self._subscribed else b'\x00\x00'
+        self._att_error(handle)
+
+    def writeCharacteristic(self, handle, val, withResponse=False):
+        self._check()
+        self.requests += 1
+        if handle in CCCD:
+            if val == b'\x00\x00':
+                self._subscribed.discard(CCCD[handle])
+            else:
+                self._subscribed.add(CCCD[handle])
+        elif handle == SYNC_TIME:
+            self.newest_time = struct.unpack('<Q', val)[0]
+            self._requested_newest = None
+        elif handle == OLDEST_TIMESTAMP:
+            self._requested_oldest = struct.unpack('<Q', val)[0]
+        elif handle == NEWEST_TIMESTAMP:
+            self._requested_newest = struct.unpack('<Q', val)[0]
+        elif handle == START_LOGGER_DOWNLOAD:
+            self._downloading = struct.unpack('<B', val)[0]
+            self._packets.clear()
+            if self._downloading:
+                self._queue_download()
+        elif handle == LOGGER_INTERVAL:
+            self.interval = struct.unpack('<I', val)[0]
+        else:
+            self._att_error(handle)
+        return {'rsp': ['wr']}
+
+    def _queue_download(self):
+        first, last = self._window()
+        channels = [(handle, values) for handle, values in ((TEMPERATURE, self.temperature),
+                                                            (HUMIDITY, self.humidity))
+                    if handle in self._subscribed]
+        for sample in range(first, last, SAMPLES_PER_PACKET):
+            end = min(last, sample + SAMPLES_PER_PACKET)
+            for handle, values in channels:
+                if self.loss_rate and self.random.random() < self.loss_rate:
+                    continue
+                self._packets.append((handle, struct.pack('<I', sample - first + 1) + values[sample:end].tobytes()))
+        self._next_packet = time.monotonic()
+
+    def _live_value(self, handle):
+        value = self.temperature[0] if handle == TEMPERATURE else self.humidity[0]
+        return struct.pack('<f', value)
+
+    def _sleep_until(self, due, timeout):
+        delay = due - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+    def _send_live(self, live):
+        # the other channels follow right away, ahead of queued download packets
+        self._next_live = time.monotonic() + self.live_interval
+        for handle in reversed(live[1:]):
+            self._packets.appendleft((handle, self._live_value(handle)))
+        return live[0], self._live_value(live[0])
+
+    def waitForNotifications(self, timeout):
+        self._check()
+        live = sorted(self._subscribed & {TEMPERATURE, HUMIDITY})
+        if self._packets and live and self.live_during_download and time.monotonic() >= self._next_live:
+            handle, data = self._send_live(live)
+        elif self._packets:
+            if self.packet_rate:
+                if not self._sleep_until(self._next_packet, timeout):
+                    return False
+                self._next_packet = max(self._next_packet, time.monotonic() - 1.) + 1. / self.packet_rate
+            handle, data = self._packets.popleft()
+        else:
+            if not live:
+                time.sleep(timeout)
+                return False
+            if not self._sleep_until(self._next_live, timeout):
+                return False
+            handle, data = self._send_live(live)
+
+        if self.delegate is not None:
+            self.delegate.handleNotification(handle, data)
+        return True
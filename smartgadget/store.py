@@ -0,0 +1,37 @@
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class JSONStore(object):
+    # json values by gadget address, the file is replaced atomically on every change
+
+    def __init__(self, path=None, name='store'):
+        self.path = path
+        self.name = name
+        self._lock = threading.Lock()
+        self._entries = {}
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, 'r') as fp:
+                    self._entries = json.load(fp)
+                log.debug("loaded {} of {} gadgets".format(self.name, len(self._entries)))
+            except ValueError:
+                # e.g. truncated by a crash, starting over is better than not starting at all
+                log.warning("ignore corrupt {} '{}'".format(self.name, path))
+
+    def get(self, addr):
+        with self._lock:
+            return self._entries.get(addr)
+
+    def _save(self):
+        if self.path is None:
+            return
+        # a crashed collector must not corrupt the file
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(self._entries, fp)
+        os.replace(tmp, self.path)
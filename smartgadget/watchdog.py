@@ -0,0 +1,164 @@
+import logging
+
+from .data import AlignedFrame
+
+log = logging.getLogger(__name__)
+
+COMPLETE = 'complete'
+PARTIAL = 'partial'
+STALLED = 'stalled'
+
+
+class DownloadResult(dict):
+    # the downloaded data by characteristic, as returned before, with the outcome of the download
+
+    def __init__(self, data, status, n_expected, n_missing, duration, stalls=0,
+                 newest_time=0, interval=0, names=None):
+        dict.__init__(self, data)
+        self.status = status
+        self.n_expected = n_expected
+        self.n_missing = n_missing
+        self.duration = duration
+        self.stalls = stalls
+        self.newest_time = newest_time
+        self.interval = interval
+        self.names = names or {}
+
+    def frame(self):
+        # the characteristics aligned on the sample axis, see AlignedFrame
+        return AlignedFrame.from_download(self, self.names, self.n_expected, self.newest_time, self.interval)
+
+    @property
+    def complete(self):
+        return self.status == COMPLETE
+
+    @property
+    def throughput(self):
+        if self.duration <= 0:
+            return 0.
+        return (self.n_expected - self.n_missing) * len(self) / self.duration
+
+    def __repr__(self):
+        return "DownloadResult({}, {} of {} samples missing, {:.1f}s)".format(self.status, self.n_missing,
+                                                                              self.n_expected, self.duration)
+
+
+class DownloadWatchdog(object):
+    # no progress for this many average packet intervals is a stall
+    STALL_INTERVALS = 20
+    MIN_STALL_TIMEOUT = 1.
+    # the dynamic deadline allows this multiple of the expected duration
+    DEADLINE_MARGIN = 2.
+    REPORT_INTERVAL = 0.5
+
+    def __init__(self, logger, timeout=None, stall_timeout=None):
+        self.logger = logger
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.clock = logger.clock
+
+        self.t0 = self.clock()
+        self.stalls = 0
+        self.expired = False
+        self._stalled = False
+        self._last_received = logger.n_received
+        self._last_progress = self.t0
+        self._packet_interval = None
+        self._last_report = self.t0
+
+    @property
+    def throughput(self):
+        # samples per second per characteristic
+        elapsed = self.clock() - self.t0
+        n_services = max(1, len(self.logger.data))
+        if elapsed <= 0 or self.logger.n_received == 0:
+            return None
+        return self.logger.n_received / n_services / elapsed
+
+    @property
+    def eta(self):
+        # seconds until all samples are expected to be there
+        throughput = self.throughput
+        if throughput is None:
+            return None
+        remaining = sum(self._missing(srv, d) for srv, d in self.logger.data.items()) / max(1, len(self.logger.data))
+        return remaining / throughput
+
+    @property
+    def deadline(self):
+        if self.timeout is not None:
+            return self.t0 + self.timeout
+        throughput = self.throughput
+        if throughput is None:
+            return None
+        return self.t0 + self.DEADLINE_MARGIN * self.logger.n_samples_total / throughput + self._stall_limit()
+
+    def _stall_limit(self):
+        if self.stall_timeout is not None:
+            return self.stall_timeout
+        if self._packet_interval is None:
+            # waiting for the first packet
+            return self.logger.DOWNLOAD_TIMEOUT
+        return max(self.MIN_STALL_TIMEOUT, self.STALL_INTERVALS * self._packet_interval)
+
+    def check(self):
+        # called from the notification loop, True once the download ended
+        logger = self.logger
+        if not logger.downloading:
+            return True
+        now = self.clock()
+
+        if logger.n_received != self._last_received:
+            gap = now - self._last_progress
+            # moving average of the time between packets that brought new samples
+            self._packet_interval = gap if self._packet_interval is None else \
+                0.9 * self._packet_interval + 0.1 * gap
+            self._last_received = logger.n_received
+            self._last_progress = now
+            self._stalled = False
+
+        elif now - self._last_progress > self._stall_limit():
+            log.warning("download stalled, no progress for {:.1f}s".format(now - self._last_progress))
+            self.stalls += 1
+            self._stalled = True
+            self._last_progress = now
+            # ends the pass, a recovery pass for the gaps follows while retries are left
+            logger.on_download_failed()
+            return not logger.downloading
+
+        deadline = self.deadline
+        if deadline is not None and now > deadline:
+            log.warning("download did not finish within {:.1f}s".format(now - self.t0))
+            self.expired = True
+            logger.stop_download()
+            return True
+
+        if now - self._last_report >= self.REPORT_INTERVAL:
+            eta = self.eta
+            log.info("downloading {:.0f}%, {}".format(
+                logger.progress(), "eta unknown" if eta is None else "eta {:.1f}s".format(eta)))
+            self._last_report = now
+        return False
+
+    def _missing(self, srv, data):
+        if self.logger.columnar:
+            return data.n_samples - data.n_received
+        return max(0, self.logger.n_samples_total - len(data))
+
+    def result(self, names=None):
+        # names {characteristic: column name} of the frame of the result
+        logger = self.logger
+        if logger.downloading:
+            # the notification loop ended before the download, e.g. stopped from another thread
+            self.expired = True
+            logger.stop_download()
+
+        n_missing = max([self._missing(srv, d) for srv, d in logger.data.items()] or [0])
+        if n_missing == 0:
+            status = COMPLETE
+        elif self._stalled:
+            status = STALLED
+        else:
+            status = PARTIAL
+        return DownloadResult(logger.data, status, logger.n_samples_total, n_missing,
+                              self.clock() - self.t0, self.stalls, logger.newest_time, logger.interval, names)
@@ -0,0 +1,88 @@
+import threading
+import time
+from array import array
+from collections import deque, namedtuple
+
+WindowStats = namedtuple('WindowStats', ['count', 'mean', 'min', 'max', 'last', 'rate', 'time'])
+
+
+class RollingWindow(object):
+    # the last capacity values of a channel, the aggregates are updated with every value in O(1)
+
+    def __init__(self, capacity, clock=time.monotonic):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1, not {}".format(capacity))
+        self.capacity = capacity
+        self.clock = clock
+        self._values = array('d', bytes(8 * capacity))
+        self._times = array('d', bytes(8 * capacity))
+        # number of values appended so far, the value n is stored at n % capacity
+        self._n = 0
+        self._sum = 0.
+        # (n, value) with increasing values for the minimum and decreasing values for the maximum
+        self._min = deque()
+        self._max = deque()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._n, self.capacity)
+
+    def append(self, value, t=None):
+        if t is None:
+            t = self.clock()
+        with self._lock:
+            n = self._n
+            i = n % self.capacity
+            if n >= self.capacity:
+                self._sum -= self._values[i]
+            self._values[i] = value
+            self._times[i] = t
+            self._sum += value
+            self._n = n + 1
+            if self._n >= self.capacity and self._n & 0xffff == 0:
+                # the running sum drifts by the rounding of every added and removed value
+                self._sum = sum(self._values)
+
+            # a value leaves the window with every append once it is full, at most one per queue
+            oldest = self._n - self.capacity
+            queue = self._min
+            while queue and queue[-1][1] >= value:
+                queue.pop()
+            queue.append((n, value))
+            if queue[0][0] < oldest:
+                queue.popleft()
+            queue = self._max
+            while queue and queue[-1][1] <= value:
+                queue.pop()
+            queue.append((n, value))
+            if queue[0][0] < oldest:
+                queue.popleft()
+
+    def snapshot(self):
+        # the aggregates of the window, rate is the change per second from the oldest to the newest value
+        with self._lock:
+            count = len(self)
+            if count == 0:
+                return WindowStats(0, None, None, None, None, None, None)
+            newest = (self._n - 1) % self.capacity
+            oldest = (self._n - count) % self.capacity
+            dt = self._times[newest] - self._times[oldest]
+            rate = (self._values[newest] - self._values[oldest]) / dt if dt > 0 else None
+            return WindowStats(count, self._sum / count, self._min[0][1], self._max[0][1],
+                               self._values[newest], rate, self._times[newest])
+
+    def values(self):
+        # copy of the values from the oldest to the newest
+        with self._lock:
+            count = len(self)
+            start = (self._n - count) % self.capacity
+            if start + count <= self.capacity:
+                return self._values[start:start + count].tolist()
+            return (self._values[start:] + self._values[:start + count - self.capacity]).tolist()
+
+    def clear(self):
+        with self._lock:
+            self._n = 0
+            self._sum = 0.
+            self._min.clear()
+            self._max.clear()
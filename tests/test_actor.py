@@ -0,0 +1,113 @@
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+from smartgadget.actor import GadgetActor
+from smartgadget.device import SmartGadget
+from smartgadget.simulator import SimulatedPeripheral
+
+
+class ExclusivePeripheral(SimulatedPeripheral):
+    # fails when two threads use the peripheral at the same time
+
+    def __init__(self, *args, **kwargs):
+        SimulatedPeripheral.__init__(self, *args, **kwargs)
+        self._busy = threading.Lock()
+        self.threads = set()
+
+    def _exclusive(self, func, *args):
+        if not self._busy.acquire(False):
+            raise AssertionError("concurrent use of the peripheral")
+        try:
+            self.threads.add(threading.current_thread())
+            return func(self, *args)
+        finally:
+            self._busy.release()
+
+    def readCharacteristic(self, handle):
+        return self._exclusive(SimulatedPeripheral.readCharacteristic, handle)
+
+    def writeCharacteristic(self, handle, val, withResponse=False):
+        return self._exclusive(SimulatedPeripheral.writeCharacteristic, handle, val, withResponse)
+
+    def waitForNotifications(self, timeout):
+        return self._exclusive(SimulatedPeripheral.waitForNotifications, timeout)
+
+
+def test_actor_serializes_calls_and_notifications():
+    gadget = SmartGadget('e2:07:bc:53:40:61')
+    gadget.peripheral_factory = ExclusivePeripheral.factory(live_interval=0.005)
+    values = []
+    gadget.Temperature.register_listener(lambda value, characteristic: values.append(value))
+
+    with GadgetActor(gadget, wait_slice=0.01) as actor:
+        actor.connect().result()
+        actor.subscribe_temperature().result()
+        actor.start_notifications()
+
+        # several consumers share the link while the notifications are pumped
+        levels = []
+        threads = [threading.Thread(target=lambda: levels.extend(actor.read_battery_level().result()
+                                                                 for _ in range(20)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        snapshot = actor.read_all().result()
+
+        assert levels == [87] * 80
+        assert snapshot.battery == 87
+        assert len(values) > 0
+        assert gadget.peripheral.threads == {actor._thread}
+
+        actor.stop_notifications().result()
+        actor.disconnect().result()
+
+    with pytest.raises(RuntimeError):
+        actor.read_battery_level()
+
+
+def test_actor_errors_and_reentrant_calls():
+    gadget = SmartGadget('e2:07:bc:53:40:61')
+    actor = GadgetActor(gadget)
+
+    # not connected yet, the error is raised by the future
+    with pytest.raises(Exception):
+        actor.read_temperature().result(5)
+
+    # a call from the actor thread runs right away
+    inner = actor.submit(lambda: actor.submit(lambda: 42).result(0)).result(5)
+    assert inner == 42
+
+    blocker = threading.Event()
+    actor.submit(blocker.wait)
+    queued = actor.submit(lambda: 1)
+    assert queued.cancel()
+    blocker.set()
+    actor.close()
+    with pytest.raises(CancelledError):
+        queued.result()
+
+
+def test_actor_close_races_submit():
+    # every call is either run or refused, none is left waiting
+    for _ in range(20):
+        actor = GadgetActor(SmartGadget('e2:07:bc:53:40:61'))
+        futures = []
+
+        def submit():
+            for i in range(50):
+                try:
+                    futures.append(actor.submit(lambda: i))
+                except RuntimeError:
+                    return
+
+        threads = [threading.Thread(target=submit) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        actor.close()
+        for thread in threads:
+            thread.join()
+        assert all(future.done() for future in futures)
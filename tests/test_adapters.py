@@ -0,0 +1,44 @@
+import os
+
+from smartgadget.adapters import AdapterCoordinator, assign_adapters, discover_adapters
+from smartgadget.device import SmartGadget
+from smartgadget.simulator import SimulatedPeripheral
+
+
+def test_discover_adapters(tmp_path):
+    for name in ['hci1', 'hci0', 'hci0:64', 'rfkill0']:
+        (tmp_path / name).mkdir()
+    assert discover_adapters(str(tmp_path)) == [0, 1]
+    assert discover_adapters(str(tmp_path / 'missing')) == [0]
+
+
+def test_assign_adapters():
+    sightings = {'a': {0: -50, 1: -52},
+                 'b': {0: -48, 1: -51},
+                 'c': {0: -60, 1: -85},
+                 'd': {0: -70},
+                 'e': {}}
+    assignment = assign_adapters(sightings, [0, 1], rssi_margin=6.)
+    # c and d are only received well on hci0, a and b are balanced on hci1
+    assert sorted(assignment[0]) == ['c', 'd', 'e']
+    assert sorted(assignment[1]) == ['a', 'b']
+
+
+def test_run_in_worker_processes(mocker):
+    mocker.patch.object(SmartGadget, 'peripheral_factory',
+                        staticmethod(SimulatedPeripheral.factory(n_samples=100, live_interval=0.01)))
+    addresses = ['e2:07:bc:53:40:{:02x}'.format(i) for i in range(6)]
+    coordinator = AdapterCoordinator(adapters=[0, 1], max_per_adapter=2, timeout=30)
+
+    results, errors = coordinator.run(lambda gadget: (gadget.iface, os.getpid(), gadget.read_temperature()),
+                                      addresses)
+
+    assert not errors
+    assert sorted(results) == addresses
+    assert sorted(iface for iface, pid, t in results.values()) == [0, 0, 0, 1, 1, 1]
+    pids = dict((iface, pid) for iface, pid, t in results.values())
+    assert len(set(pids.values())) == 2 and os.getpid() not in pids.values()
+
+    results, errors = coordinator.download_temperature_and_relative_humidity(addresses=addresses[:2])
+    assert not errors
+    assert all(r['temperature'].complete and len(r['relative_humidity']) == 100 for r in results.values())
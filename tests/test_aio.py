@@ -0,0 +1,77 @@
+import asyncio
+import struct
+import time
+
+import pytest
+from bluepy.btle import BTLEDisconnectError
+
+from smartgadget.aio import AsyncSmartGadget
+
+
+class Peripheral(object):
+
+    def __init__(self, gadget):
+        self.gadget = gadget
+        self.calls = 0
+
+    def waitForNotifications(self, timeout):
+        self.calls += 1
+        time.sleep(0.01)
+        self.gadget.handleNotification(self.gadget.Temperature.valHandle, struct.pack('<f', 20. + self.calls))
+        return True
+
+
+def test_read_and_notifications(mocker):
+    gadget = AsyncSmartGadget('e2:07:bc:53:40:61')
+    mocker.patch.object(gadget.gadget, 'read_temperature', return_value=21.5)
+    gadget.gadget.Temperature.valHandle = 35
+    gadget.gadget.RelativeHumidity.valHandle = 40
+    gadget.gadget._handlers = {35: gadget.gadget.Temperature, 40: gadget.gadget.RelativeHumidity}
+    gadget.gadget.peripheral = Peripheral(gadget.gadget)
+
+    async def run():
+        values = []
+        async with gadget.notifications(gadget.gadget.Temperature) as stream:
+            async for characteristic, value in stream:
+                values.append(value)
+                if len(values) == 3:
+                    break
+            # reads are interleaved with the notification pump
+            temperature = await gadget.read_temperature()
+        return values, temperature
+
+    values, temperature = asyncio.run(run())
+
+    assert values == [21., 22., 23.]
+    assert temperature == 21.5
+
+
+class LostPeripheral(object):
+
+    def waitForNotifications(self, timeout):
+        raise BTLEDisconnectError("Device disconnected")
+
+
+def test_notifications_lost_link():
+    gadget = AsyncSmartGadget('e2:07:bc:53:40:61')
+    gadget.gadget.peripheral = LostPeripheral()
+    gadget.gadget.connected = True
+
+    async def run():
+        async with gadget.notifications(gadget.gadget.Temperature) as stream:
+            async for _ in stream:
+                pass
+
+    with pytest.raises(BTLEDisconnectError):
+        asyncio.run(run())
+    assert not gadget.gadget.connected
+
+
+def test_download_arguments(mocker):
+    gadget = AsyncSmartGadget('e2:07:bc:53:40:61')
+    download = mocker.patch.object(gadget.gadget, 'download_temperature_and_relative_humidity', return_value={})
+
+    asyncio.run(gadget.download(columnar=True, retries=2))
+
+    # no hard limit by default, the download watchdog sets the deadline
+    download.assert_called_once_with(None, columnar=True, retries=2)
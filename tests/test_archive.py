@@ -0,0 +1,71 @@
+import math
+from array import array
+
+from smartgadget.archive import DownloadArchive
+from smartgadget.data import AlignedFrame
+
+ADDR = 'e2:07:bc:53:40:61'
+
+
+def frame(newest_time, values, valid=None):
+    # samples newest first at 1000 ms, humidity is the temperature plus 40
+    n = len(values)
+    valid = bytearray(b'\x01' * n) if valid is None else bytearray(valid)
+    return AlignedFrame(n, newest_time, 1000,
+                        {'temperature': array('f', values), 'relative_humidity': array('f', [v + 40 for v in values])},
+                        {'temperature': valid, 'relative_humidity': valid})
+
+
+def test_archive_append_and_query(tmp_path):
+    archive = DownloadArchive(str(tmp_path))
+    assert archive.query(ADDR).times == array('q')
+
+    # 5000..1000, the sample at 3000 is missing
+    assert archive.append(ADDR, frame(5000, [5., 4., 3., 2., 1.], b'\x01\x01\x00\x01\x01')) == 4
+    # overlaps 4000 and 5000, fills nothing in the past and appends 6000 and 7000
+    assert archive.append(ADDR, frame(7000, [7., 6., 5., 4.])) == 2
+    assert archive.append(ADDR, frame(7000, [7., 6.])) == 0
+    # the same samples after a sync shifted the clock of the gadget
+    assert archive.append(ADDR, frame(7300, [7., 6.])) == 0
+    assert [(b.start, b.end) for b in archive.blocks(ADDR)] == [(1000, 2000), (4000, 5000), (6000, 7000)]
+
+    result = archive.query(ADDR)
+    assert list(result.times) == [1000, 2000, 4000, 5000, 6000, 7000]
+    assert list(result.columns['temperature']) == [1., 2., 4., 5., 6., 7.]
+    assert list(result.columns['relative_humidity']) == [41., 42., 44., 45., 46., 47.]
+
+    # the missing sample comes with a later download
+    assert archive.append(ADDR, frame(3000, [3.])) == 1
+
+    reopened = DownloadArchive(str(tmp_path))
+    result = reopened.query(ADDR, 1500, 6000)
+    assert list(result.times) == [2000, 3000, 4000, 5000]
+    assert list(result.columns['temperature']) == [2., 3., 4., 5.]
+
+
+def test_archive_block_size_and_missing_channel(tmp_path):
+    archive = DownloadArchive(str(tmp_path))
+    archive.BLOCK_SAMPLES = 3
+    f = frame(10000, [float(v) for v in range(10, 0, -1)])
+    f.valid['relative_humidity'] = bytearray(b'\x01' * 9 + b'\x00')
+    assert archive.append(ADDR, f) == 10
+    assert [b.n_samples for b in archive.blocks(ADDR)] == [3, 3, 3, 1]
+
+    result = archive.query(ADDR, 0, 2500)
+    assert list(result.times) == [1000, 2000]
+    assert math.isnan(result.columns['relative_humidity'][0]) and result.columns['temperature'][0] == 1.
+
+
+def test_download_into_archive(tmp_path):
+    from smartgadget.device import SmartGadget
+    from smartgadget.simulator import SimulatedPeripheral
+
+    archive = DownloadArchive(str(tmp_path))
+    dev = SmartGadget(ADDR)
+    dev.peripheral_factory = SimulatedPeripheral.factory(n_samples=300)
+    dev.connect()
+    first = dev.download_temperature_and_relative_humidity(columnar=True, archive=archive)
+    result = archive.query(ADDR)
+    assert list(result.times) == list(reversed(first[dev.Temperature].times))
+    assert list(result.columns['temperature']) == list(reversed(first[dev.Temperature].values))
+    assert archive.append(ADDR, first.frame()) == 0
@@ -0,0 +1,29 @@
+from smartgadget.capture import NotificationCapture, replay, replay_gadget
+from smartgadget.device import SmartGadget
+from smartgadget.simulator import SimulatedPeripheral, TEMPERATURE
+
+
+def test_capture_and_replay_download(tmp_path):
+    path = str(tmp_path / 'download.sgcap')
+
+    with NotificationCapture(path) as capture:
+        dev = SmartGadget('e2:07:bc:53:40:61', capture=capture)
+        dev.peripheral_factory = SimulatedPeripheral.factory(n_samples=300, loss_rate=0.1, live_interval=0.01)
+        dev.connect()
+        dev.Logging.DOWNLOAD_TIMEOUT = 0.05
+        data = dev.download_temperature_and_relative_humidity(timeout=10, retries=100)
+        recorded = dict((str(srv.service_uuid), list(values)) for srv, values in data.items())
+
+    # replayed as fast as possible, the recovery passes follow the captured timeouts
+    gadget = replay_gadget(path)
+    gadget.Logging.DOWNLOAD_TIMEOUT = 0.05
+    data = gadget.download_temperature_and_relative_humidity(timeout=10, retries=100)
+
+    assert not gadget.Logging.downloading
+    assert gadget.peripheral.remaining == 0
+    assert dict((str(srv.service_uuid), list(values)) for srv, values in data.items()) == recorded
+
+    received = []
+    n = replay(path, lambda handle, data: received.append(handle), realtime=False)
+    assert n == len(received) > 150
+    assert TEMPERATURE in received
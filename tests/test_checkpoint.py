@@ -0,0 +1,22 @@
+from smartgadget.checkpoint import DownloadCheckpoint
+
+
+def test_checkpoint(tmp_path):
+    path = str(tmp_path / 'checkpoints.json')
+
+    checkpoint = DownloadCheckpoint(path)
+    assert checkpoint.get('e2:07:bc:53:40:61') is None
+    checkpoint.update('e2:07:bc:53:40:61', 20000)
+    checkpoint.update('e2:07:bc:53:40:61', 10000)
+
+    assert DownloadCheckpoint(path).get('e2:07:bc:53:40:61') == 20000
+
+
+def test_corrupt_checkpoint(tmp_path):
+    path = tmp_path / 'checkpoints.json'
+    path.write_text('{"e2:07:bc:53:40:61": 200')
+
+    checkpoint = DownloadCheckpoint(str(path))
+    assert checkpoint.get('e2:07:bc:53:40:61') is None
+    checkpoint.update('e2:07:bc:53:40:61', 20000)
+    assert DownloadCheckpoint(str(path)).get('e2:07:bc:53:40:61') == 20000
@@ -0,0 +1,37 @@
+import json
+import subprocess
+import sys
+
+from smartgadget.cli import main
+from smartgadget.device import SmartGadget
+from smartgadget.simulator import SimulatedPeripheral
+
+ADDRESSES = ['e2:07:bc:53:40:61', 'e2:07:bc:53:40:62']
+
+
+def records(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_read_and_download(mocker, capsys):
+    mocker.patch.object(SmartGadget, 'peripheral_factory',
+                        staticmethod(SimulatedPeripheral.factory(n_samples=50, live_interval=0.01)))
+
+    assert main(['read'] + ADDRESSES) == 0
+    readings = sorted(records(capsys), key=lambda r: r['address'])
+    assert [r['address'] for r in readings] == ADDRESSES
+    assert readings[0]['battery'] == 87
+    assert readings[0]['temperature'] == 20.
+
+    assert main(['download', '-n', '2'] + ADDRESSES) == 0
+    lines = records(capsys)
+    samples = [r for r in lines if 'sample' in r]
+    assert len(samples) == 2 * 2 * 50
+    assert sorted((r['address'], r['download']) for r in lines if 'download' in r) == \
+        [(addr, 'complete') for addr in ADDRESSES]
+    assert set(r['sample'] for r in samples if r['address'] == ADDRESSES[1] and 'temperature' in r) == set(range(50))
+
+
+def test_startup_does_not_import_bluepy():
+    code = "import sys, smartgadget.cli; print('bluepy' in sys.modules or 'pkg_resources' in sys.modules)"
+    assert subprocess.check_output([sys.executable, '-c', code]).strip() == b'False'
@@ -0,0 +1,29 @@
+import struct
+
+import pytest
+
+from smartgadget.codec import codec_for, Codec, FLOAT32, RAW, UINT64
+from smartgadget.services import Float32Service, Uint8Service
+
+
+def test_codecs():
+    assert codec_for('<f') is FLOAT32
+    assert codec_for(None) is RAW and RAW.decode(b'\x01\x02') == b'\x01\x02'
+    assert UINT64.decode(UINT64.encode(1579000000000)) == 1579000000000
+
+    payload = struct.pack('<I4f', 7, 1., 2., 3., 4.) + b'\x00'
+    assert FLOAT32.count(len(payload) - 4) == 4
+    assert FLOAT32.decode_many(payload, 4) == [1., 2., 3., 4.]
+    assert FLOAT32.decode_many(bytearray(payload), 4, 2) == [1., 2.]
+
+    pair = codec_for('<hH')
+    assert isinstance(pair, Codec) and pair.n_values == 2
+    assert list(pair.decode_many(struct.pack('<hHhH', -1, 2, 3, 4))) == [(-1, 2), (3, 4)]
+    with pytest.raises(struct.error):
+        FLOAT32.decode(b'\x00')
+
+
+def test_characteristic_codecs():
+    assert Float32Service("00002234-b38d-4985-720e-0f993a68ee41").unpack_data(struct.pack('<f', 21.5)) == 21.5
+    battery = Uint8Service("180F", codec=codec_for('<b'))
+    assert battery.unpack_data(b'\xff') == -1
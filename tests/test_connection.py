@@ -0,0 +1,32 @@
+from bluepy.btle import BTLEDisconnectError
+
+from smartgadget.connection import ManagedSmartGadget
+from smartgadget.device import SmartGadget
+
+
+def test_reconnect_restores_subscriptions(mocker):
+    gadget = SmartGadget('e2:07:bc:53:40:61')
+
+    attempts = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) == 2:
+            raise BTLEDisconnectError("failed")
+        gadget.connected = True
+        gadget.Temperature._subscribed = None
+
+    mocker.patch.object(gadget, 'connect', side_effect=connect)
+    mocker.patch.object(gadget, 'disconnect')
+    mocker.patch.object(gadget.Temperature, 'subscribe')
+    mocker.patch.object(gadget, 'read_temperature', side_effect=[BTLEDisconnectError("Device disconnected"), 21.5])
+    wait = mocker.patch('threading.Event.wait')
+
+    managed = ManagedSmartGadget(gadget, min_backoff=1., jitter=0.)
+    managed.connect()
+    gadget.Temperature._subscribed = True
+
+    assert managed.read_temperature() == 21.5
+    assert managed.reconnects == 1
+    assert gadget.Temperature.subscribe.call_count == 1
+    wait.assert_called_once_with(1.)
@@ -0,0 +1,58 @@
+import math
+import struct
+
+import pytest
+
+from smartgadget.data import AlignedFrame, ColumnarData
+
+
+def test_columnar_data():
+    data = ColumnarData(6, newest_time=10000, interval=1000)
+
+    assert data.put(0, struct.pack('<ff', 1., 2.)) == 2
+    assert data.put(4, struct.pack('<fff', 5., 6., 7.)) == 2  # clipped at the end of the buffer
+
+    assert list(data.values) == [1., 2., 0., 0., 5., 6.]
+    assert list(data.times) == [10000, 9000, 8000, 7000, 6000, 5000]
+    assert data.missing == [2, 3]
+    assert data.n_received == 4
+    assert not data.complete
+
+    data.put(2, struct.pack('<ff', 3., 4.))
+    assert data.complete
+    assert list(data.values) == [1., 2., 3., 4., 5., 6.]
+
+
+class _Channel(object):
+    byte_format = '<f'
+
+
+def test_aligned_frame():
+    temperature, humidity = _Channel(), _Channel()
+    names = {temperature: 'temperature', humidity: 'relative_humidity'}
+    rh = ColumnarData(4, newest_time=4000, interval=1000)
+    rh.put(0, struct.pack('<fff', 50., 51., 52.))
+    data = {temperature: [(0, 4000, 20.), (2, 2000, 22.), (3, 1000, 23.)], humidity: rh}
+
+    frame = AlignedFrame.from_download(data, names, 4, 4000, 1000)
+
+    assert frame.names == ['relative_humidity', 'temperature']
+    assert list(frame.times) == [4000, 3000, 2000, 1000]
+    assert list(frame.rows()) == [(0, 4000, 50., 20.), (2, 2000, 52., 22.)]
+    assert math.isnan(frame['temperature'][1]) and math.isnan(frame['relative_humidity'][3])
+    # the columnar download is not copied
+    assert frame['relative_humidity'] is rh.values
+
+    values, valid = frame.buffers()['temperature']
+    assert values.format == 'f' and values.nbytes == 16
+    assert bytes(valid) == b'\x01\x00\x01\x01'
+
+
+def test_aligned_frame_to_numpy():
+    np = pytest.importorskip('numpy')
+    channel = _Channel()
+    frame = AlignedFrame.from_download({channel: [(1, 1000, 2.)]}, {channel: 'temperature'}, 2, 2000, 1000)
+    arrays = frame.to_numpy()
+    assert list(arrays['time']) == [2000, 1000]
+    assert list(arrays['temperature_valid']) == [False, True]
+    assert np.shares_memory(arrays['temperature'], np.frombuffer(frame['temperature'], dtype='f'))
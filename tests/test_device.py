@@ -1,8 +1,14 @@
 import binascii
+import logging
+import threading
+import time
 
-from bluepy.btle import ADDR_TYPE_RANDOM
+import pytest
+from bluepy.btle import ADDR_TYPE_RANDOM, BTLEDisconnectError, BTLEInternalError
 
+from smartgadget.cache import HandleCache
 from smartgadget.device import SmartGadget
+from smartgadget.simulator import SimulatedPeripheral
 
 from test_scanner import Responses
 
@@ -38,3 +44,240 @@ from test_scanner import Responses
 #     mocker.patch.object(dev.peripheral, '_waitResp', side_effect=Responses(responses))
 #
 #     dev.connect()
+
+
+def test_connect_with_handle_cache(mocker, tmp_path):
+    mocker.patch.object(SmartGadget, 'peripheral_factory', SimulatedPeripheral)
+    cache = HandleCache(str(tmp_path / 'handles.json'))
+
+    dev = SmartGadget('e2:07:bc:53:40:61', handle_cache=cache)
+    dev.connect()
+    # services are discovered on first use
+    assert dev.peripheral.requests == 0
+    assert dev.read_battery_level() == 87
+    assert dev.peripheral.requests == 3
+    # every service is cached once it is discovered
+    assert list(cache.get(dev.addr)) == [str(dev.Battery.service_uuid)]
+
+    # the cached services are connected, the others discovered on first use
+    dev = SmartGadget('e2:07:bc:53:40:61', handle_cache=HandleCache(cache.path))
+    dev.connect()
+    assert dev.peripheral.requests == 1
+    assert dev.Battery.service is not None and dev.Temperature.service is None
+    dev.read_temperature()
+    assert dev.peripheral.requests == 4
+    assert len(HandleCache(cache.path).get(dev.addr)) == 2
+    for service in dev.services:
+        service.resolve()
+
+    dev = SmartGadget('e2:07:bc:53:40:61', handle_cache=HandleCache(cache.path))
+    dev.connect()
+    assert dev.peripheral.requests == 1
+    assert dev.Logging.LoggerIntervalMs.valHandle == 62
+    # descriptions are read on first access only
+    assert dev.Temperature.description == 'Temperature °C'
+    assert dev.Temperature.unit == '°C'
+    assert dev.peripheral.requests == 2
+
+
+class IdlePeripheral(object):
+
+    def __init__(self):
+        self.waits = []
+
+    def waitForNotifications(self, timeout):
+        self.waits.append(timeout)
+        time.sleep(timeout)
+        return False
+
+
+def test_listen_for_notifications_deadline_and_stop():
+    dev = SmartGadget('e2:07:bc:53:40:61')
+    dev.peripheral = IdlePeripheral()
+
+    t0 = time.monotonic()
+    assert not dev.listen_for_notifications(0.25)
+    assert 0.25 <= time.monotonic() - t0 < 0.3
+    assert max(dev.peripheral.waits) <= SmartGadget.MAX_NOTIFICATION_WAIT
+
+    threading.Timer(0.1, dev.stop_listening).start()
+    t0 = time.monotonic()
+    assert not dev.listen_for_notifications()
+    assert time.monotonic() - t0 < 0.1 + 2 * SmartGadget.MAX_NOTIFICATION_WAIT
+
+    calls = []
+    assert dev.listen_for_notifications(5, until=lambda: calls.append(1) or len(calls) > 2)
+
+
+def test_download_from_simulated_gadget():
+    dev = SmartGadget('e2:07:bc:53:40:61')
+    dev.peripheral_factory = SimulatedPeripheral.factory(n_samples=500, loss_rate=0.1, live_interval=0.01)
+    dev.connect()
+    dev.Logging.DOWNLOAD_TIMEOUT = 0.05
+
+    data = dev.download_temperature_and_relative_humidity(timeout=10, retries=100)
+
+    assert not dev.Logging.downloading
+    for srv, values in ((dev.Temperature, dev.peripheral.temperature),
+                        (dev.RelativeHumidity, dev.peripheral.humidity)):
+        assert [s for s, t, v in data[srv]] == list(range(500))
+        assert [v for s, t, v in data[srv]] == list(values)
+
+
+def test_download_with_interleaved_live_values(mocker):
+    dev = SmartGadget('e2:07:bc:53:40:61')
+    dev.peripheral_factory = SimulatedPeripheral.factory(n_samples=2000, packet_rate=2000, live_interval=0.005,
+                                                         live_during_download=True)
+    dev.connect()
+    dev.Logging.DOWNLOAD_TIMEOUT = 0.1
+    live = []
+    dev.Temperature.register_listener(lambda value, srv: live.append(value))
+    failed = mocker.spy(dev.Logging, 'on_download_failed')
+
+    # the pass outlasts DOWNLOAD_TIMEOUT with live values between the packets and still ends complete
+    result = dev.download_temperature_and_relative_humidity(columnar=True, retries=0)
+    assert result.complete
+    assert not failed.called
+    assert len(live) > 10
+
+
+def test_download_recovers_scattered_gaps(mocker):
+    dev = SmartGadget('e2:07:bc:53:40:61')
+    dev.peripheral_factory = SimulatedPeripheral.factory(n_samples=4000, loss_rate=0.01, live_interval=10.)
+    dev.connect()
+    recovery = mocker.spy(dev.Logging, '_start_recovery')
+
+    # a single retry re-downloads every gap, not only the first window of gaps
+    result = dev.download_temperature_and_relative_humidity(columnar=True, retries=1)
+    assert recovery.call_count > 3
+    assert result.complete
+
+
+def test_download_does_not_read_descriptions(caplog):
+    read = []
+
+    class Peripheral(SimulatedPeripheral):
+        def readCharacteristic(self, handle):
+            read.append(handle)
+            return SimulatedPeripheral.readCharacteristic(self, handle)
+
+    dev = SmartGadget('e2:07:bc:53:40:61')
+    dev.peripheral_factory = Peripheral.factory(n_samples=100)
+    dev.connect()
+    with caplog.at_level(logging.INFO):
+        assert dev.download_temperature_and_relative_humidity().complete
+    # the user descriptions next to the temperature and humidity values
+    assert not {35, 40} & set(read)
+
+
+def test_abort_hanging_connect(mocker):
+    class Helper(object):
+        def __init__(self):
+            self.killed = threading.Event()
+
+        def kill(self):
+            self.killed.set()
+
+    class HangingPeripheral(object):
+        # connects like bluepy, the helper is started before the connect hangs
+        def __init__(self):
+            self._helper = None
+
+        def connect(self, addr, addrType=None, iface=None):
+            self._helper = Helper()
+            self._helper.killed.wait(5)
+            raise BTLEInternalError("Helper exited")
+
+    mocker.patch('smartgadget.device.Peripheral', HangingPeripheral)
+    mocker.patch.object(SmartGadget, 'peripheral_factory', HangingPeripheral)
+    dev = SmartGadget('e2:07:bc:53:40:61')
+    threading.Timer(0.1, dev.abort).start()
+
+    t0 = time.monotonic()
+    with pytest.raises(BTLEInternalError):
+        dev.connect()
+    assert time.monotonic() - t0 < 2
+
+
+def test_lost_link_clears_connected():
+    dev = SmartGadget('e2:07:bc:53:40:61')
+    dev.peripheral_factory = SimulatedPeripheral
+    dev.connect()
+    assert dev.is_connected() and dev.read_battery_level() == 87
+
+    # the gadget went out of range
+    dev.peripheral.connected = False
+    with pytest.raises(BTLEDisconnectError):
+        dev.read_battery_level()
+    assert not dev.is_connected()
+
+
+def test_live_window():
+    dev = SmartGadget('e2:07:bc:53:40:61')
+    dev.peripheral_factory = SimulatedPeripheral.factory(live_interval=0.01)
+    dev.connect()
+    dev.keep_windows(3)
+    dev.subscribe_temperature()
+
+    dev.listen_for_notifications(until=lambda: dev.Temperature.window.snapshot().count == 3)
+    stats = dev.window_stats()
+    assert sorted(stats) == ['relative_humidity', 'temperature']
+    assert stats['relative_humidity'].count == 0
+    assert stats['temperature'].min <= stats['temperature'].mean <= stats['temperature'].max
+    assert stats['temperature'].last == dev.Temperature.window.values()[-1]
+
+
+def test_read_all_with_ttl():
+    dev = SmartGadget('e2:07:bc:53:40:61')
+    dev.peripheral_factory = SimulatedPeripheral
+    dev.connect()
+    peripheral = dev.peripheral
+
+    dev.read_all()
+    dev.Logging.resolve()
+    requests = peripheral.requests
+    snapshot = dev.read_all()
+    assert (snapshot.addr, snapshot.temperature, snapshot.battery) == ('e2:07:bc:53:40:61', 20., 87)
+    assert peripheral.requests == requests + 3
+
+    dev.cache_reads(60.)
+    dev.read_all()
+    requests = peripheral.requests
+    peripheral.battery = 50
+    assert dev.read_all().battery == 87
+    assert dev.Logging.LoggerIntervalMs.read() == 1000
+    dev.Logging.LoggerIntervalMs.read()
+    assert peripheral.requests == requests + 1
+    assert dev.read_all(max_age=0).battery == 50
+
+    # a write invalidates the cached value
+    dev.Logging.LoggerIntervalMs.write(2000)
+    assert dev.Logging.LoggerIntervalMs.read() == 2000
+
+
+def test_download_watchdog_outcome():
+    dev = SmartGadget('e2:07:bc:53:40:61')
+    dev.peripheral_factory = SimulatedPeripheral.factory(n_samples=400, loss_rate=0.2, live_interval=10.)
+    dev.connect()
+
+    # the last packets are lost and no retries allowed, the stall is detected without a short packet
+    result = dev.download_temperature_and_relative_humidity(retries=0, stall_timeout=0.2)
+    assert result.status == 'stalled' and result.stalls == 1
+    assert result.n_expected == 400 and 0 < result.n_missing < 400
+    assert result.duration < 2.
+
+    dev.peripheral.loss_rate = 0.
+    result = dev.download_temperature_and_relative_humidity(columnar=True)
+    assert result.complete and result.n_missing == 0
+    assert result[dev.Temperature].complete
+    frame = result.frame()
+    assert len(frame) == 400 and frame.names == ['relative_humidity', 'temperature']
+    assert frame['temperature'] is result[dev.Temperature].values
+
+    # a hard timeout ends a slow download early
+    dev.peripheral.packet_rate = 500.
+    result = dev.download_temperature_and_relative_humidity(timeout=0.2)
+    assert result.status == 'partial'
+    assert 0 < result.n_missing < 400
+    assert not dev.Logging.downloading
+    assert dev.Logging.resume_time < dev.Logging.newest_time
@@ -0,0 +1,47 @@
+import struct
+import threading
+
+from smartgadget.device import SmartGadget
+from smartgadget.dispatch import NotificationDispatcher, DROP_OLDEST, DROP_NEWEST
+
+
+def test_decode_once_and_dispatch_by_handle(mocker):
+    gadget = SmartGadget('e2:07:bc:53:40:61')
+    gadget.Temperature.valHandle = 35
+    gadget._handlers = {35: gadget.Temperature}
+    unpack = mocker.spy(gadget.Temperature, 'unpack_data')
+
+    values = []
+    gadget.Temperature.register_listener(lambda value, ch: values.append(value))
+    gadget.Temperature.register_listener(lambda value, ch: values.append(value))
+
+    gadget.handleNotification(35, struct.pack('<f', 21.5))
+    gadget.handleNotification(40, struct.pack('<f', 50.))
+
+    assert values == [21.5, 21.5]
+    assert unpack.call_count == 1
+
+
+def check_overflow(overflow):
+    release = threading.Event()
+    values = []
+
+    def slow_listener(value, ch):
+        release.wait()
+        values.append(value)
+
+    dispatcher = NotificationDispatcher(maxsize=2, overflow=overflow)
+    dispatcher.submit([slow_listener], 0, None)
+    while not dispatcher._queue.empty():
+        pass
+    # the worker is blocked in the first value, the queue holds two of the remaining values
+    for i in range(1, 5):
+        dispatcher.submit([slow_listener], i, None)
+    release.set()
+    dispatcher.close(1.)
+    return values, dispatcher.dropped
+
+
+def test_dispatcher_overflow():
+    assert check_overflow(DROP_OLDEST) == ([0, 3, 4], 2)
+    assert check_overflow(DROP_NEWEST) == ([0, 1, 2], 2)
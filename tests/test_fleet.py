@@ -0,0 +1,111 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from smartgadget.fleet import SmartGadgetFleet, FleetTimeout
+
+
+class Gadget(object):
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+
+    def __init__(self, addr, iface=0, duration=0.05, fail=False, partial=False, blocking=False, hanging=False):
+        self.addr = addr
+        self.iface = iface
+        self.duration = duration
+        self.fail = fail
+        # returns what it has when stopped, like a download
+        self.partial = partial
+        # ignores stop_listening, like a blocked bluepy call
+        self.blocking = blocking
+        # connect only returns when aborted, like an unanswered connection request
+        self.hanging = hanging
+        self.connected = False
+        self.stopped = threading.Event()
+        self.aborted = threading.Event()
+        self.Logging = SimpleNamespace(downloading=False)
+
+    def connect(self):
+        if self.hanging:
+            self.aborted.wait()
+            raise Exception("connect aborted")
+        self.connected = True
+
+    def disconnect(self):
+        assert not isinstance(threading.current_thread(), threading.Timer), "disconnect from the timer"
+        self.connected = False
+
+    def stop_listening(self):
+        if not self.blocking:
+            self.stopped.set()
+
+    def abort(self):
+        self.aborted.set()
+
+    def download_temperature_and_relative_humidity(self, timeout=15):
+        with Gadget.lock:
+            Gadget.running += 1
+            Gadget.max_running = max(Gadget.max_running, Gadget.running)
+        self.Logging.downloading = True
+        try:
+            if (self.aborted if self.blocking else self.stopped).wait(self.duration):
+                if self.partial:
+                    return {'addr': self.addr, 'partial': True}
+                raise Exception("stopped")
+            if self.fail:
+                raise ValueError("download failed")
+            return {'addr': self.addr}
+        finally:
+            self.Logging.downloading = False
+            with Gadget.lock:
+                Gadget.running -= 1
+
+
+def test_fleet_download():
+    gadgets = dict((g.addr, g) for g in [Gadget('a'), Gadget('b'), Gadget('c', fail=True),
+                                         Gadget('d'), Gadget('e', duration=5)])
+    fleet = SmartGadgetFleet(gadgets, max_workers=8, max_per_adapter=2, timeout=0.5)
+
+    t0 = time.time()
+    results, errors = fleet.run(lambda gadget: gadget.download_temperature_and_relative_humidity())
+
+    assert time.time() - t0 < 2
+    assert sorted(results) == ['a', 'b', 'd']
+    assert isinstance(errors['c'], ValueError)
+    assert isinstance(errors['e'], FleetTimeout)
+    assert Gadget.max_running <= 2
+    assert not any(g.connected for g in gadgets.values())
+
+
+def test_fleet_timeout_stops_jobs():
+    gadgets = [Gadget('a', duration=5, partial=True), Gadget('b', duration=5, blocking=True)]
+    fleet = SmartGadgetFleet(gadgets, timeout=0.2)
+    fleet.ABORT_GRACE = 0.2
+
+    t0 = time.time()
+    results, errors = fleet.run(lambda gadget: gadget.download_temperature_and_relative_humidity())
+
+    assert time.time() - t0 < 2
+    # the stopped download keeps its samples, the blocked one is aborted
+    assert results == {'a': {'addr': 'a', 'partial': True}}
+    assert isinstance(errors['b'], FleetTimeout)
+    assert not gadgets[0].aborted.is_set() and gadgets[1].aborted.is_set()
+
+
+def test_fleet_download_is_not_limited_by_the_fleet_timeout():
+    # a large log takes longer than the fleet timeout, the download watchdog ends it
+    fleet = SmartGadgetFleet([Gadget('a', duration=0.5)], timeout=0.1)
+    results, errors = fleet.download_temperature_and_relative_humidity()
+    assert results == {'a': {'addr': 'a'}} and not errors
+
+    # the fleet timeout still limits connecting
+    fleet = SmartGadgetFleet([Gadget('c', hanging=True)], timeout=0.1)
+    fleet.ABORT_GRACE = 0.1
+    results, errors = fleet.download_temperature_and_relative_humidity()
+    assert isinstance(errors['c'], FleetTimeout)
+
+    # a hard download timeout limits the job
+    fleet = SmartGadgetFleet([Gadget('b', duration=5)], timeout=0.1)
+    results, errors = fleet.download_temperature_and_relative_humidity(0.1)
+    assert isinstance(errors['b'], FleetTimeout)
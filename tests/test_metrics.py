@@ -0,0 +1,52 @@
+from smartgadget.device import SmartGadget
+from smartgadget.metrics import MetricsRegistry
+from smartgadget.simulator import SimulatedPeripheral
+
+
+def test_render():
+    registry = MetricsRegistry()
+    registry.counter('requests_total', "Requests", ['address']).labels('e2:07:bc:53:40:61').inc(3)
+    registry.gauge('temperature', "Temperature\nin C").labels().set(21.5)
+    histogram = registry.histogram('duration_seconds', "Duration", buckets=(0.1, 1.)).labels()
+    for value in (0.05, 0.5, 5.):
+        histogram.observe(value)
+
+    assert registry.render() == '\n'.join([
+        '# HELP duration_seconds Duration',
+        '# TYPE duration_seconds histogram',
+        'duration_seconds_bucket{le="0.1"} 1',
+        'duration_seconds_bucket{le="1"} 2',
+        'duration_seconds_bucket{le="+Inf"} 3',
+        'duration_seconds_sum 5.55',
+        'duration_seconds_count 3',
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{address="e2:07:bc:53:40:61"} 3',
+        '# HELP temperature Temperature\\nin C',
+        '# TYPE temperature gauge',
+        'temperature 21.5',
+    ]) + '\n'
+    assert registry.collect()['requests_total'] == [({'address': 'e2:07:bc:53:40:61'}, 3)]
+
+
+def test_gadget_metrics():
+    registry = MetricsRegistry()
+    dev = SmartGadget('e2:07:bc:53:40:61', metrics=registry)
+    dev.peripheral_factory = SimulatedPeripheral.factory(n_samples=400, loss_rate=0.1, live_interval=0.01)
+    dev.connect()
+    dev.Logging.DOWNLOAD_TIMEOUT = 0.05
+    dev.download_temperature_and_relative_humidity(timeout=10, retries=100)
+
+    metrics = dict((name, dict((labels.get('service'), value) for labels, value in samples))
+                   for name, samples in registry.collect().items())
+    assert metrics['smartgadget_connects_total'] == {None: 1}
+    assert metrics['smartgadget_connected'] == {None: 1}
+    assert metrics['smartgadget_downloads_total'] == {None: 1}
+    assert metrics['smartgadget_download_missing_samples'] == {None: 0}
+    assert metrics['smartgadget_download_missed_samples_total']['temperature'] > 0
+    assert metrics['smartgadget_download_samples_total']['temperature'] >= 400
+    assert metrics['smartgadget_notifications_total']['relative_humidity'] >= 100
+    assert 'smartgadget_download_throughput_samples_per_second' in registry.render()
+
+    dev.disconnect()
+    assert registry.collect()['smartgadget_connected'] == [({'address': 'e2:07:bc:53:40:61'}, 0)]
@@ -1,9 +1,11 @@
 import binascii
+import struct
 
 from bluepy.btle import ADDR_TYPE_RANDOM
 
 from smartgadget.device import SmartGadget
-from smartgadget.scanner import SmartGadgetScanner
+from smartgadget.advertisement import decode_manufacturer_data
+from smartgadget.scanner import SmartGadgetScanner, APPEARED, UPDATED, DISAPPEARED
 
 
 class Responses(object):
@@ -61,6 +63,85 @@ def test_scan(mocker):
         assert addr == 'e2:07:bc:53:40:61'
         assert isinstance(dev, SmartGadget)
 
+
+def test_scan_events(mocker):
+    scanner = SmartGadgetScanner()
+
+    mocker.patch.object(scanner, '_helper')
+    mocker.patch.object(scanner, '_startHelper')
+    mocker.patch.object(scanner, '_stopHelper')
+    mocker.patch.object(scanner, '_mgmtCmd')
+    mocker.patch.object(scanner, '_writeCmd')
+
+    gadget = {'rsp': ['scan'],
+              'addr': [binascii.unhexlify("e207bc534061")],
+              'type': [ADDR_TYPE_RANDOM],
+              'rssi': [76],
+              'flag': [0],
+              'code': ['success'],
+              'd': [b'\x02\x01\x06\x11\tSmart Humigadget']}
+    moved = dict(gadget, rssi=[60])
+
+    responses = {1: {'code': ['success']},
+                 2: gadget,
+                 3: gadget,
+                 4: moved}
+
+    mocker.patch.object(scanner, '_waitResp', side_effect=Responses(responses))
+
+    events = [(e.kind, e.gadget.addr) for e in scanner.scan_events(last_seen_timeout=0.1, timeout=0.5)]
+
+    assert events == [(APPEARED, 'e2:07:bc:53:40:61'),
+                      (UPDATED, 'e2:07:bc:53:40:61'),
+                      (DISAPPEARED, 'e2:07:bc:53:40:61')]
+    assert scanner.gadgets['e2:07:bc:53:40:61'].rssi == -60
+    assert not scanner.gadgets['e2:07:bc:53:40:61'].present
+
+
+def manufacturer_data(temperature, humidity):
+    return struct.pack('<HBBHHH', 0x06D5, 0, 4, 0x4061,
+                       int(round((temperature + 45.) * 65535. / 175.)),
+                       int(round(humidity * 65535. / 100.)))
+
+
+def test_decode_manufacturer_data():
+    t, rh = decode_manufacturer_data(manufacturer_data(21.5, 48.2))
+    assert abs(t - 21.5) < 0.01 and abs(rh - 48.2) < 0.01
+
+    assert decode_manufacturer_data(b'\x4c\x00\x02\x15') is None
+
+
+def test_scan_readings(mocker):
+    scanner = SmartGadgetScanner()
+
+    mocker.patch.object(scanner, '_helper')
+    mocker.patch.object(scanner, '_startHelper')
+    mocker.patch.object(scanner, '_stopHelper')
+    mocker.patch.object(scanner, '_mgmtCmd')
+    mocker.patch.object(scanner, '_writeCmd')
+
+    def advertisement(temperature, humidity):
+        data = manufacturer_data(temperature, humidity)
+        return {'rsp': ['scan'],
+                'addr': [binascii.unhexlify("e207bc534061")],
+                'type': [ADDR_TYPE_RANDOM],
+                'rssi': [76],
+                'flag': [0],
+                'd': [b'\x11\tSmart Humigadget' + bytes([len(data) + 1, 0xff]) + data]}
+
+    responses = {1: {'code': ['success']},
+                 2: advertisement(21.5, 48.2),
+                 3: advertisement(21.5, 48.2),
+                 4: advertisement(21.6, 48.0)}
+
+    mocker.patch.object(scanner, '_waitResp', side_effect=Responses(responses))
+
+    readings = list(scanner.readings(timeout=0.2))
+
+    assert [(r.addr, round(r.temperature, 1), round(r.relative_humidity, 1), r.rssi) for r in readings] == \
+           [('e2:07:bc:53:40:61', 21.5, 48.2, -76), ('e2:07:bc:53:40:61', 21.6, 48.0, -76)]
+
+
 # def test_scan_real():
 #     from bluepy.btle import DefaultDelegate, Scanner
 #     from smartgadget.scanner import is_smartgadget
@@ -0,0 +1,53 @@
+import threading
+import time
+
+from smartgadget.scheduler import PollingScheduler
+
+
+class Gadget(object):
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+
+    def __init__(self, addr, fail=False):
+        self.addr = addr
+        self.fail = fail
+        self.polls = 0
+
+
+started = []
+
+
+def poll(gadget):
+    started.append(gadget.addr)
+    with Gadget.lock:
+        Gadget.running += 1
+        Gadget.max_running = max(Gadget.max_running, Gadget.running)
+    try:
+        time.sleep(0.05)
+        if gadget.fail:
+            raise IOError("unreachable")
+        gadget.polls += 1
+        return gadget.polls
+    finally:
+        with Gadget.lock:
+            Gadget.running -= 1
+
+
+def test_polling_scheduler():
+    gadgets = [Gadget(addr) for addr in 'abcdef'] + [Gadget('x', fail=True)]
+    scheduler = PollingScheduler(gadgets, interval=0.1, max_connections=2, jitter=0.1,
+                                 min_backoff=0.2, max_backoff=0.4, poll=poll)
+    scheduler.add(Gadget('p'), priority=100.)
+
+    scheduler.run(duration=1.)
+
+    assert Gadget.max_running <= 2
+    # the high priority gadget goes first, the unreachable one backs off
+    assert started[0] == 'p'
+    rates = scheduler.report()
+    assert rates['x'].polls == 0 and 2 <= rates['x'].failures <= 4
+    # 2 connections at 50ms per poll cannot keep up with 7 gadgets at 10/s, the capacity is shared fairly
+    polls = [rates[addr].polls for addr in 'abcdef']
+    assert max(polls) - min(polls) <= 3
+    assert all(r.target == 10. and r.achieved < 0.8 * r.target for r in rates.values())
@@ -0,0 +1,94 @@
+import struct
+
+from smartgadget.intervals import IntervalSet
+from smartgadget.services import Float32Service, LoggingService
+
+
+def test_interval_set():
+    s = IntervalSet()
+    s.add(10, 20)
+    s.add(30, 40)
+    s.add(20, 25)
+    assert list(s) == [(10, 25), (30, 40)]
+    assert len(s) == 25
+
+    s.discard(12, 35)
+    assert list(s) == [(10, 12), (35, 40)]
+    assert 11 in s and 12 not in s and 35 in s and 40 not in s
+    assert len(s) == 7
+
+    s.add(0, 100)
+    assert list(s) == [(0, 100)]
+
+
+def packet(seq, values):
+    return struct.pack('<I', seq) + struct.pack('<{}f'.format(len(values)), *values)
+
+
+def logging_service(mocker, newest_times, oldest_times):
+    temperature = Float32Service("00002234-b38d-4985-720e-0f993a68ee41")
+    temperature.valHandle = 35
+    temperature._subscribed = True
+    temperature._description_cache = "Temperature °C"
+
+    logger = LoggingService("0000f234-b38d-4985-720e-0f993a68ee41", subscribables=[temperature])
+    logger.service = mocker.Mock()
+    mocker.patch('smartgadget.services.time.sleep')
+    mocker.patch.object(logger.LoggerIntervalMs, 'read', return_value=1000)
+    mocker.patch.object(logger.NewestTimestampMs, 'read', side_effect=newest_times)
+    mocker.patch.object(logger.OldestTimestampMs, 'read', side_effect=oldest_times)
+    for ch in (logger.SyncTimeMs, logger.OldestTimestampMs, logger.NewestTimestampMs, logger.StartLoggerDownload):
+        mocker.patch.object(ch, 'write')
+    return logger, temperature
+
+
+def test_download_recovers_missed_samples(mocker):
+    logger, temperature = logging_service(mocker, [20000, 16000], [8000, 14000])
+
+    logger.start_download()
+    assert logger.n_samples_to_download == 12
+
+    logger.handleNotification(35, packet(1, [1., 2., 3., 4.]))
+    # samples 4 and 5 are lost
+    logger.handleNotification(35, packet(7, [7., 8., 9., 10.]))
+    logger.handleNotification(35, packet(11, [11., 12.]))
+
+    # a second pass is started for the gap only
+    assert logger.downloading
+    assert list(logger.missed_sequences[temperature]) == [(4, 6)]
+    logger.OldestTimestampMs.write.assert_called_with(14000)
+    logger.NewestTimestampMs.write.assert_called_with(16000)
+
+    logger.handleNotification(35, packet(1, [5., 6.]))
+
+    assert not logger.downloading
+    assert len(logger.missed_sequences[temperature]) == 0
+    assert [v for _, _, v in logger.data[temperature]] == [float(i) for i in range(1, 13)]
+    assert [t for _, t, _ in logger.data[temperature]] == list(range(20000, 8000, -1000))
+
+
+def test_incremental_download(mocker):
+    logger, temperature = logging_service(mocker, [20000], [16000])
+
+    logger.start_download(since=16000)
+    logger.OldestTimestampMs.write.assert_called_with(16000)
+    assert logger.n_samples_to_download == 4
+
+    logger.handleNotification(35, packet(1, [1., 2.]))
+    logger.handleNotification(35, packet(3, [3., 4.]))
+
+    assert not logger.downloading
+    assert logger.resume_time == 20000
+
+
+def test_resume_time_with_missing_samples(mocker):
+    logger, temperature = logging_service(mocker, [20000], [8000])
+
+    logger.start_download(retries=0)
+    logger.handleNotification(35, packet(1, [1., 2., 3., 4.]))
+    logger.handleNotification(35, packet(7, [7., 8., 9., 10.]))
+    logger.handleNotification(35, packet(11, [11., 12.]))
+
+    assert not logger.downloading
+    # the next download has to start before the missing samples 4 and 5
+    assert logger.resume_time == 14000
@@ -0,0 +1,29 @@
+import random
+
+import pytest
+
+from smartgadget.window import RollingWindow
+
+
+def test_rolling_window():
+    window = RollingWindow(5)
+    assert window.snapshot().count == 0
+
+    rng = random.Random(0)
+    values = [rng.uniform(-10., 40.) for _ in range(200)]
+    for i, value in enumerate(values):
+        window.append(value, t=2. * i)
+        recent = values[max(0, i - 4):i + 1]
+        stats = window.snapshot()
+        assert window.values() == recent
+        assert (stats.count, stats.min, stats.max, stats.last) == (len(recent), min(recent), max(recent), value)
+        assert stats.mean == pytest.approx(sum(recent) / len(recent))
+        if i > 0:
+            assert stats.rate == pytest.approx((value - recent[0]) / (2. * (len(recent) - 1)))
+
+    window.clear()
+    window.append(1., t=0.)
+    assert window.values() == [1.] and window.snapshot().rate is None
+
+    with pytest.raises(ValueError):
+        RollingWindow(0)